@@ -3,7 +3,6 @@ import os
 import re
 
 from app.plugins.ai.gemini.configs import SAFETY_SETTINGS
-from app.plugins.ai.gemini.utils import upload_tg_file
 from google.genai.client import Client
 from google.genai.types import (
     Content,
@@ -15,6 +14,9 @@ from pyrogram.types import ReplyParameters
 from ub_core.utils import get_tg_media_details, run_shell_cmd
 
 from app import BOT, LOGGER, Convo, Message, bot
+from app.modules.governor import governed_generate
+from app.modules.media import media_part
+from app.modules.perf import span
 
 from .config import AIG_MODEL_LIST, get_system_prompt_with_tree
 from .functions import execute_function
@@ -25,7 +27,8 @@ from .tools import AIGENT_TOOLS, URL_CONTEXT_TOOL
 # Gemini client & config
 # ---------------------------------------------------------------------------
 
-_aigent_client = Client(api_key=os.getenv("AUTOBOT_GEMINI_API_KEY")).aio
+_AIGENT_API_KEY = os.getenv("AUTOBOT_GEMINI_API_KEY")
+_aigent_client = Client(api_key=_AIGENT_API_KEY).aio
 
 # ---------------------------------------------------------------------------
 # Model rotation
@@ -235,10 +238,7 @@ async def aigent_cmd(bot: BOT, message: Message):
                 media = get_tg_media_details(reply)
                 file_name = getattr(media, "file_name", "file") or "file"
                 await status_msg.edit(f"<code>uploading {file_name}...</code>")
-                uploaded = await upload_tg_file(message=reply, check_size=False)
-                replied_file_part = Part.from_uri(
-                    file_uri=uploaded.uri, mime_type=uploaded.mime_type
-                )
+                replied_file_part = await media_part(reply, perf_cmd="aig")
                 replied_context = f"[User replied to a file: {file_name}]"
             except Exception as e:
                 LOGGER.error(f"Aigent file upload error: {e}")
@@ -272,111 +272,134 @@ async def aigent_cmd(bot: BOT, message: Message):
     final_text = None
     last_func_names = []
 
-    for _ in range(max_iterations):
-        try:
-            response = await _aigent_client.models.generate_content(
-                contents=contents,
-                model=model_name,
-                config=aig_config,
-            )
-        except Exception as e:
-            LOGGER.error(f"Aigent generation error: {e}")
-            await status_msg.edit(f"<code>error: {e}</code>")
-            return
-
-        if not response.candidates or not response.candidates[0].content:
-            await status_msg.edit("<code>no response.</code>")
-            return
-
-        candidate = response.candidates[0]
-        parts = candidate.content.parts or []
-
-        # Collect all function calls from this response
-        func_calls = [p for p in parts if p.function_call]
-
-        if func_calls:
-            func_names = [p.function_call.name for p in func_calls]
-            last_func_names = func_names
-            await status_msg.edit(
-                f"<code>calling: {', '.join(func_names)}...</code>"
-            )
+    # Timed as a whole, including the error and early-return paths.
+    with span("aig", "tool_loop"):
+        for _ in range(max_iterations):
+            try:
+                with span("aig", "generate"):
+                    response = await governed_generate(
+                        _aigent_client,
+                        _AIGENT_API_KEY,
+                        contents=contents,
+                        model=model_name,
+                        config=aig_config,
+                    )
+            except Exception as e:
+                LOGGER.error(f"Aigent generation error: {e}")
+                await status_msg.edit(f"<code>error: {e}</code>")
+                return
 
-            # Append the full model response (with all function calls)
-            contents.append(candidate.content)
-
-            # Execute each function call and collect responses
-            response_parts = []
-            for fc_part in func_calls:
-                func_name = fc_part.function_call.name
-                func_args = (
-                    dict(fc_part.function_call.args)
-                    if fc_part.function_call.args
-                    else {}
-                )
+            if not response.candidates or not response.candidates[0].content:
+                await status_msg.edit("<code>no response.</code>")
+                return
 
-                # Inject message reference for download_replied_file
-                if func_name == "download_replied_file" and reply and reply.media:
-                    func_args["_message"] = reply
+            candidate = response.candidates[0]
+            parts = candidate.content.parts or []
 
-                result = await execute_function(func_name, func_args)
+            # Collect all function calls from this response
+            func_calls = [p for p in parts if p.function_call]
 
-                # Handle create_file: upload to chat
-                if func_name == "create_file" and result.startswith("FILE_CREATED:"):
-                    file_path = result.split("FILE_CREATED: ", 1)[1].strip()
-                    if os.path.exists(file_path):
-                        try:
-                            await bot.send_document(
-                                chat_id=chat_id,
-                                document=file_path,
-                                caption=f"<code>{os.path.basename(file_path)}</code>",
-                                reply_parameters=ReplyParameters(message_id=message.id),
-                            )
-                        except Exception as e:
-                            LOGGER.error(f"Aigent file upload error: {e}")
-
-                # Handle upload_file: upload existing file to chat
-                elif func_name == "upload_file" and result.startswith("UPLOAD_FILE:"):
-                    file_path = result.split("UPLOAD_FILE: ", 1)[1].strip()
-                    if os.path.exists(file_path):
+            if func_calls:
+                func_names = [p.function_call.name for p in func_calls]
+                last_func_names = func_names
+                await status_msg.edit(
+                    f"<code>calling: {', '.join(func_names)}...</code>"
+                )
+
+                # Append the full model response (with all function calls)
+                contents.append(candidate.content)
+
+                # Execute each function call and collect responses
+                response_parts = []
+                for fc_part in func_calls:
+                    func_name = fc_part.function_call.name
+                    func_args = (
+                        dict(fc_part.function_call.args)
+                        if fc_part.function_call.args
+                        else {}
+                    )
+
+                    # Inject message reference for download_replied_file
+                    if (
+                        func_name == "download_replied_file"
+                        and reply
+                        and reply.media
+                    ):
+                        func_args["_message"] = reply
+
+                    with span("aig", f"tool:{func_name}"):
+                        result = await execute_function(func_name, func_args)
+
+                    # Handle create_file: upload to chat
+                    if func_name == "create_file" and result.startswith(
+                        "FILE_CREATED:"
+                    ):
+                        file_path = result.split("FILE_CREATED: ", 1)[1].strip()
+                        if os.path.exists(file_path):
+                            try:
+                                await bot.send_document(
+                                    chat_id=chat_id,
+                                    document=file_path,
+                                    caption=(
+                                        f"<code>{os.path.basename(file_path)}</code>"
+                                    ),
+                                    reply_parameters=ReplyParameters(
+                                        message_id=message.id
+                                    ),
+                                )
+                            except Exception as e:
+                                LOGGER.error(f"Aigent file upload error: {e}")
+
+                    # Handle upload_file: upload existing file to chat
+                    elif func_name == "upload_file" and result.startswith(
+                        "UPLOAD_FILE:"
+                    ):
+                        file_path = result.split("UPLOAD_FILE: ", 1)[1].strip()
+                        if os.path.exists(file_path):
+                            try:
+                                await bot.send_document(
+                                    chat_id=chat_id,
+                                    document=file_path,
+                                    caption=(
+                                        f"<code>{os.path.basename(file_path)}</code>"
+                                    ),
+                                    reply_parameters=ReplyParameters(
+                                        message_id=message.id
+                                    ),
+                                )
+                                name = os.path.basename(file_path)
+                                result = f"Uploaded {name} to chat."
+                            except Exception as e:
+                                LOGGER.error(f"Aigent upload_file error: {e}")
+                                result = f"ERROR uploading file: {e}"
+
+                    # Handle edit_file: show diff, wait for user approval
+                    elif func_name == "edit_file":
                         try:
-                            await bot.send_document(
-                                chat_id=chat_id,
-                                document=file_path,
-                                caption=f"<code>{os.path.basename(file_path)}</code>",
-                                reply_parameters=ReplyParameters(message_id=message.id),
-                            )
-                            result = f"Uploaded {os.path.basename(file_path)} to chat."
-                        except Exception as e:
-                            LOGGER.error(f"Aigent upload_file error: {e}")
-                            result = f"ERROR uploading file: {e}"
-
-                # Handle edit_file: show diff, wait for user approval
-                elif func_name == "edit_file":
-                    try:
-                        parsed = json.loads(result)
-                        if parsed.get("type") == "EDIT_PROPOSAL":
-                            result = await _handle_edit_proposal(
-                                result, chat_id, message
-                            )
-                    except (json.JSONDecodeError, TypeError):
-                        pass  # result is already an error string
-
-                response_parts.append(
-                    Part.from_function_response(
-                        name=func_name,
-                        response={"result": result},
+                            parsed = json.loads(result)
+                            if parsed.get("type") == "EDIT_PROPOSAL":
+                                result = await _handle_edit_proposal(
+                                    result, chat_id, message
+                                )
+                        except (json.JSONDecodeError, TypeError):
+                            pass  # result is already an error string
+
+                    response_parts.append(
+                        Part.from_function_response(
+                            name=func_name,
+                            response={"result": result},
+                        )
                     )
-                )
 
-            # Append all function responses as a single user turn
-            contents.append(Content(role="user", parts=response_parts))
-            continue
+                # Append all function responses as a single user turn
+                contents.append(Content(role="user", parts=response_parts))
+                continue
 
-        # No function calls — final text response
-        text_parts = [p.text for p in parts if p.text]
-        if text_parts:
-            final_text = "\n".join(text_parts).strip()
-        break
+            # No function calls — final text response
+            text_parts = [p.text for p in parts if p.text]
+            if text_parts:
+                final_text = "\n".join(text_parts).strip()
+            break
 
     # If no text response but tool calls were made, generate a completion message
     if not final_text and last_func_names:
@@ -409,4 +432,5 @@ async def aigent_cmd(bot: BOT, message: Message):
             for cmd in shell_matches:
                 await _handle_shell_command(cmd, convo, message)
     else:
-        await status_msg.edit(final_text[:4096])
+        with span("aig", "edit"):
+            await status_msg.edit(final_text[:4096])
@@ -2,7 +2,8 @@ import json
 import os
 import difflib
 
-from app import LOGGER
+from app import LOGGER, extra_config
+from app.modules.governor import governed_generate
 from app.modules.models import ask_ai
 
 from .config import AIG_TEMP_DIR, PROJECT_ROOT
@@ -20,8 +21,8 @@ async def ask_default_ai(prompt: str, with_codebase: bool = False) -> str:
 
             kwargs = await get_model_and_config(model_name="THINK")
 
-            response = await async_client.models.generate_content(
-                contents=prompts, **kwargs
+            response = await governed_generate(
+                async_client, extra_config.GEMINI_API_KEY, contents=prompts, **kwargs
             )
 
             result = Response(response)
@@ -102,7 +103,9 @@ async def edit_file(filepath: str, instruction: str) -> str:
     from app.plugins.ai.gemini.client import async_client as default_client
     from google.genai.types import GenerateContentConfig
 
-    response = await default_client.models.generate_content(
+    response = await governed_generate(
+        default_client,
+        extra_config.GEMINI_API_KEY,
         contents=[edit_prompt],
         model="gemini-2.5-flash",
         config=GenerateContentConfig(
@@ -12,6 +12,8 @@ from pyrogram.errors import FloodWait
 from ub_core.utils.helpers import get_name
 
 from app import BOT, LOGGER, Message, bot, extra_config
+from app.modules.governor import Priority, governed_generate
+from app.modules.perf import span
 
 from .config import (
     ACTIVE_DURATION,
@@ -84,9 +86,8 @@ def _ensure_passive_task():
 # Gemini client & generation config
 # ---------------------------------------------------------------------------
 
-_autobot_client = Client(
-    api_key=AUTOBOT_GEMINI_API_KEY or extra_config.GEMINI_API_KEY
-).aio
+_AUTOBOT_API_KEY = AUTOBOT_GEMINI_API_KEY or extra_config.GEMINI_API_KEY
+_autobot_client = Client(api_key=_AUTOBOT_API_KEY).aio
 
 SAFETY_OFF = [
     SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
@@ -196,11 +197,17 @@ async def _generate_response(history: list, contextual: bool = False) -> str | N
             _last_logged_model = model_name
             LOGGER.info(f"Autobot using model: {model_name}")
 
-        response = await _autobot_client.models.generate_content(
-            contents=contents,
-            model=model_name,
-            config=AUTOBOT_CONFIG,
-        )
+        # Background traffic: queued behind user commands on the same key.
+        stage = "contextual" if contextual else "generate"
+        with span("autobot", stage):
+            response = await governed_generate(
+                _autobot_client,
+                _AUTOBOT_API_KEY,
+                Priority.BACKGROUND,
+                contents=contents,
+                model=model_name,
+                config=AUTOBOT_CONFIG,
+            )
 
         if (
             response.candidates
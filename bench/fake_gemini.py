@@ -0,0 +1,240 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+# ---------------------------------------------------------------------------
+# Offline stand-in for the Gemini REST API.
+#
+# Serves generateContent, streamGenerateContent (SSE) and the resumable
+# Files API closely enough for google-genai clients pointed at it with
+# HttpOptions(base_url=server.url). Latency, jitter and error rates are
+# configurable so handlers can be benchmarked without quota or network.
+# ---------------------------------------------------------------------------
+
+LOREM = (
+    "the quick brown fox jumps over the lazy dog while the bot keeps "
+    "answering questions about music, code and whatever else comes up "
+).split()
+
+
+def text_response(text: str, model: str, prompt_tokens: int = 0) -> dict:
+    return _response([{"text": text}], model, prompt_tokens, len(text) // 4 + 1)
+
+
+def function_call_response(name: str, args: dict, model: str) -> dict:
+    return _response([{"functionCall": {"name": name, "args": args}}], model, 0, 8)
+
+
+def _response(parts: list, model: str, prompt_tokens: int, output_tokens: int):
+    return {
+        "candidates": [
+            {
+                "content": {"role": "model", "parts": parts},
+                "finishReason": "STOP",
+                "index": 0,
+            }
+        ],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+def request_text(body: dict) -> str:
+    """Concatenated text of every part in a generateContent request."""
+    return " ".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def synthetic_responder(words: int = 60):
+    """Answer with lorem text, or a JSON message list when JSON is requested."""
+
+    def respond(model: str, body: dict) -> dict:
+        prompt_tokens = len(request_text(body)) // 4
+        config = body.get("generationConfig", {})
+        if config.get("responseMimeType") == "application/json":
+            payload = [{"text": "lol same", "reply_to_id": None, "is_thought": False}]
+            return text_response(json.dumps(payload), model, prompt_tokens)
+        text = " ".join(random.choice(LOREM) for _ in range(words))
+        return text_response(text, model, prompt_tokens)
+
+    return respond
+
+
+def replay_responder(path: str):
+    """Cycle through raw responses recorded one JSON object per line."""
+    with open(path, encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    cycle = itertools.cycle(recorded)
+
+    def respond(model: str, body: dict) -> dict:
+        return next(cycle)
+
+    return respond
+
+
+class FakeGeminiServer:
+    def __init__(
+        self,
+        responder=None,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        stream_chunks: int = 8,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.responder = responder or synthetic_responder()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stream_chunks = stream_chunks
+        self.host = host
+        self.port = port
+        self.files: dict[str, dict] = {}
+        self.calls: dict[str, int] = {}
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/v1beta/models/{model_action}", self._models)
+        app.router.add_post("/upload/v1beta/files", self._upload_start)
+        app.router.add_post("/upload/session/{file_id}", self._upload_finish)
+        app.router.add_get("/v1beta/files/{file_id}", self._get_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _delay(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-1, 1) * self.jitter))
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _error(self) -> web.Response | None:
+        if random.random() >= self.error_rate:
+            return None
+        self._count("errors")
+        return web.json_response(
+            {
+                "error": {
+                    "code": self.error_status,
+                    "message": "injected by fake gemini",
+                    "status": "UNAVAILABLE",
+                }
+            },
+            status=self.error_status,
+        )
+
+    async def _models(self, request: web.Request):
+        model, _, action = request.match_info["model_action"].partition(":")
+        body = await request.json()
+        self._count(action)
+
+        if error := self._error():
+            await self._delay()
+            return error
+
+        response = self.responder(model, body)
+
+        if action == "streamGenerateContent":
+            return await self._stream(request, response)
+
+        await self._delay()
+        return web.json_response(response)
+
+    async def _stream(self, request: web.Request, response: dict):
+        stream = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await stream.prepare(request)
+
+        parts = response["candidates"][0]["content"]["parts"]
+        text = "".join(part.get("text", "") for part in parts)
+        if not text:
+            await self._delay()
+            await stream.write(f"data: {json.dumps(response)}\r\n\r\n".encode())
+            return stream
+
+        # Time to first token is a third of the latency, the rest is spread
+        # over the remaining chunks.
+        size = max(1, len(text) // self.stream_chunks)
+        pieces = [text[i : i + size] for i in range(0, len(text), size)]
+        per_chunk = self.latency * 2 / 3 / max(1, len(pieces) - 1)
+        await asyncio.sleep(self.latency / 3)
+
+        for idx, piece in enumerate(pieces):
+            chunk = json.loads(json.dumps(response))
+            chunk["candidates"][0]["content"]["parts"] = [{"text": piece}]
+            if idx < len(pieces) - 1:
+                chunk["candidates"][0].pop("finishReason", None)
+            await stream.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            if idx < len(pieces) - 1:
+                await asyncio.sleep(per_chunk)
+
+        return stream
+
+    async def _upload_start(self, request: web.Request):
+        self._count("upload")
+        body = await request.json() if request.can_read_body else {}
+        file_id = uuid.uuid4().hex[:12]
+        self.files[file_id] = {
+            "name": f"files/{file_id}",
+            "displayName": body.get("file", {}).get("displayName", file_id),
+            "mimeType": request.headers.get(
+                "X-Goog-Upload-Header-Content-Type", "application/octet-stream"
+            ),
+            "sizeBytes": request.headers.get("X-Goog-Upload-Header-Content-Length", "0"),
+            "uri": f"{self.url}v1beta/files/{file_id}",
+            "state": "ACTIVE",
+            "createTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        return web.Response(
+            headers={"X-Goog-Upload-URL": f"{self.url}upload/session/{file_id}"}
+        )
+
+    async def _upload_finish(self, request: web.Request):
+        await request.read()
+        await self._delay()
+        file_id = request.match_info["file_id"]
+        return web.json_response(
+            {"file": self.files[file_id]}, headers={"X-Goog-Upload-Status": "final"}
+        )
+
+    async def _get_file(self, request: web.Request):
+        self._count("files.get")
+        file = self.files.get(request.match_info["file_id"])
+        if not file:
+            return web.json_response(
+                {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}},
+                status=404,
+            )
+        return web.json_response(file)
@@ -0,0 +1,131 @@
+import itertools
+import time
+from datetime import datetime
+
+# ---------------------------------------------------------------------------
+# Minimal Telegram stand-ins for driving handlers offline.
+#
+# Only the attributes the plugins touch are modelled; anything else reads
+# as None so optional checks (media, sender_chat, ...) take the plain path.
+# ---------------------------------------------------------------------------
+
+_message_ids = itertools.count(1000)
+
+
+class _Fake:
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+
+class FakeUser(_Fake):
+    def __init__(self, user_id: int = 1, first_name: str = "Leaf", is_self=False):
+        self.id = user_id
+        self.first_name = first_name
+        self.last_name = None
+        self.username = first_name.lower()
+        self.is_self = is_self
+        self.is_bot = False
+        self.is_premium = False
+
+
+class FakeChat(_Fake):
+    def __init__(self, chat_id: int = -100123, title: str = "bench"):
+        self.id = chat_id
+        self.title = title
+
+
+class FakeMessage(_Fake):
+    def __init__(
+        self,
+        client: "FakeClient",
+        text: str = "",
+        chat: FakeChat | None = None,
+        from_user: FakeUser | None = None,
+        cmd: str | None = None,
+        replied: "FakeMessage | None" = None,
+        mentioned: bool = False,
+    ):
+        self._client = client
+        self.id = next(_message_ids)
+        self.chat = chat or FakeChat()
+        self.from_user = from_user or FakeUser()
+        self.date = datetime.now()
+        self.text = text
+        self.caption = None
+        self.cmd = cmd
+        self.replied = replied
+        self.reply_to_message = replied
+        self.mentioned = mentioned
+        self.edits: list[tuple[float, str]] = []
+
+        words = text.split()
+        self.flags = [word for word in words if word.startswith("-")]
+        self.input = text
+        self.filtered_input = " ".join(w for w in words if not w.startswith("-"))
+
+    async def reply(self, text: str = "", **kwargs) -> "FakeMessage":
+        return await self._client.send_message(chat_id=self.chat.id, text=text)
+
+    async def edit(self, text: str = "", **kwargs) -> "FakeMessage":
+        self.text = text
+        self.edits.append((time.perf_counter(), text))
+        self._client.edit_count += 1
+        return self
+
+    edit_text = edit
+
+    async def delete(self, *_, **__):
+        return True
+
+    async def log(self, *_, **__):
+        return self
+
+
+class FakeClient(_Fake):
+    """Stand-in for the BOT client: sends, edits and serves chat history."""
+
+    def __init__(self):
+        self.me = FakeUser(user_id=0, first_name="bot", is_self=True)
+        self.bot = self
+        self.history: dict[int, list[FakeMessage]] = {}
+        self.sent: list[FakeMessage] = []
+        self.edit_count = 0
+
+    def seed_history(self, chat_id: int, count: int, words: int = 12, salt: int = 0):
+        """Fill a chat with ``count`` text messages from a few senders."""
+        senders = [FakeUser(i, name) for i, name in enumerate(("ana", "bo", "cy"), 2)]
+        chat = FakeChat(chat_id)
+        self.history[chat_id] = [
+            FakeMessage(
+                self,
+                text=" ".join(f"word{(i * 7 + j + salt) % 97}" for j in range(words)),
+                chat=chat,
+                from_user=senders[i % len(senders)],
+            )
+            for i in range(count)
+        ]
+
+    async def get_chat_history(
+        self, chat_id: int, limit: int = 0, offset_id: int = 0, min_id: int = 0, **_
+    ):
+        """Newest first, only ids above ``min_id`` and below ``offset_id``."""
+        newest_first = [
+            msg
+            for msg in self.history.get(chat_id, [])[::-1]
+            if msg.id > min_id and (not offset_id or msg.id < offset_id)
+        ]
+        for msg in newest_first[:limit] if limit else newest_first:
+            yield msg
+
+    async def send_message(self, chat_id: int, text: str = "", **_) -> FakeMessage:
+        message = FakeMessage(self, text=text, chat=FakeChat(chat_id), from_user=self.me)
+        self.sent.append(message)
+        return message
+
+    async def send_document(self, chat_id: int, document=None, **_) -> FakeMessage:
+        return await self.send_message(chat_id=chat_id, text=str(document))
+
+    async def log_text(self, *_, **__):
+        return None
@@ -0,0 +1,327 @@
+"""
+Offline benchmark for the AI handlers.
+
+Drives r_question, summ, aigent_cmd (with a scripted multi-step tool loop)
+and both autobot handlers against the fake Gemini server and fake
+Telegram objects, then reports throughput, latency and allocations.
+
+Run from the bot root so ``app`` is importable:
+
+    python -m app.modules.bench.run -n 50 -c 5
+    python -m app.modules.bench.run --json new.json --baseline old.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .fake_gemini import (
+    FakeGeminiServer,
+    function_call_response,
+    replay_responder,
+    synthetic_responder,
+    text_response,
+)
+from .fakes import FakeChat, FakeClient, FakeMessage
+
+HANDLERS = ("r", "sm", "aig", "autobot", "autobot_proactive")
+
+# Tool calls the scripted aigent model makes before answering.
+AIG_TOOL_STEPS = 2
+
+
+def _unwrap(func):
+    """Skip run_basic_check style guards, they need a live config."""
+    return getattr(func, "__wrapped__", func)
+
+
+def aigent_responder(read_path: str, fallback):
+    """Scripted model: call read_file AIG_TOOL_STEPS times, then answer."""
+
+    def respond(model: str, body: dict) -> dict:
+        has_functions = any(
+            "functionDeclarations" in tool for tool in body.get("tools") or []
+        )
+        if not has_functions:
+            return fallback(model, body)
+
+        tools_called = sum(
+            1
+            for content in body.get("contents", [])
+            for part in content.get("parts", [])
+            if "functionResponse" in part
+        )
+        if tools_called < AIG_TOOL_STEPS:
+            return function_call_response("read_file", {"filepath": read_path}, model)
+        return text_response(f"read it {tools_called} times, looks fine.", model)
+
+    return respond
+
+
+class Bench:
+    def __init__(self, args, server: FakeGeminiServer, workdir: str):
+        self.args = args
+        self.server = server
+        self.workdir = workdir
+        self.client = FakeClient()
+
+    def patch(self):
+        """Point every Gemini client at the fake server, lift quotas, isolate state."""
+        from google.genai import Client
+        from google.genai.types import HttpOptions
+
+        from .. import chatarchive, governor, models
+        from ..aigent import aigent, history as aigent_history
+        from ..autobot import autobot, history as autobot_history
+
+        fake = Client(
+            api_key="fake-key",
+            http_options=HttpOptions(base_url=self.server.url, api_version="v1beta"),
+        ).aio
+
+        models.async_client = fake
+        aigent._aigent_client = fake
+        autobot._autobot_client = fake
+        autobot._bot = self.client
+
+        if not self.args.governor:
+            governor.MODEL_LIMITS.clear()
+            governor.DEFAULT_LIMITS = (10**6, 10**9, 10**4)
+
+        if not self.args.cache:
+            for name in models.CACHE_TTL:
+                models.CACHE_TTL[name] = 0
+
+        aigent_history.HISTORY_DIR = os.path.join(self.workdir, "aigent")
+        autobot_history.HISTORY_DIR = os.path.join(self.workdir, "autobot")
+        os.makedirs(aigent_history.HISTORY_DIR, exist_ok=True)
+        os.makedirs(autobot_history.HISTORY_DIR, exist_ok=True)
+
+        # summary binds CHAT_ARCHIVE by name, so the instance is repointed.
+        archive = chatarchive.CHAT_ARCHIVE
+        archive.root = os.path.join(self.workdir, "chat_archive")
+        archive._conns.clear()
+        os.makedirs(archive.root, exist_ok=True)
+
+    def make_call(self, handler: str):
+        """Return ``call(i)`` running one invocation of ``handler``."""
+        client = self.client
+
+        if handler == "r":
+            from ..text import r_question
+
+            func = _unwrap(r_question)
+
+            async def call(i):
+                message = FakeMessage(client, text=f"question number {i}", cmd="r")
+                await func(client, message)
+
+        elif handler == "sm":
+            from ..summary import summ
+
+            func = _unwrap(summ)
+
+            async def call(i):
+                chat_id = -200_000 - i
+                client.seed_history(chat_id, self.args.sm_messages, salt=i)
+                message = FakeMessage(
+                    client,
+                    text=str(self.args.sm_messages),
+                    chat=FakeChat(chat_id),
+                    cmd="sm",
+                )
+                await func(client, message)
+
+        elif handler == "aig":
+            from ..aigent.aigent import aigent_cmd
+
+            async def call(i):
+                message = FakeMessage(
+                    client,
+                    text=f"check the file, run {i}",
+                    chat=FakeChat(-300_000 - i),
+                    cmd="aig",
+                )
+                await aigent_cmd(client, message)
+
+        elif handler in ("autobot", "autobot_proactive"):
+            from ..autobot import autobot
+
+            reactive = handler == "autobot"
+            func = (
+                autobot.autobot_reactive_handler
+                if reactive
+                else autobot.autobot_handler
+            )
+
+            async def call(i):
+                chat_id = -400_000 - i % max(1, self.args.concurrency)
+                autobot._enabled_chats.add(chat_id)
+                message = FakeMessage(
+                    client,
+                    text=f"reya what do you think about {i}",
+                    chat=FakeChat(chat_id),
+                    mentioned=reactive,
+                )
+                await func(None, message)
+
+        else:
+            raise ValueError(f"unknown handler {handler}")
+
+        return call
+
+    async def run_handler(self, handler: str) -> dict:
+        from ..perf import Histogram
+
+        call = self.make_call(handler)
+        histogram = Histogram()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        errors = 0
+        edits_before = self.client.edit_count
+        calls_before = dict(self.server.calls)
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await call(i)
+                except Exception:
+                    errors += 1
+                histogram.record(time.perf_counter() - start)
+
+        # Warm-up outside the measurement: imports, client sessions, caches.
+        try:
+            await call(-1)
+        except Exception:
+            pass
+
+        if self.args.alloc:
+            tracemalloc.start()
+            snapshot = tracemalloc.take_snapshot()
+
+        wall = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(self.args.iterations)))
+        wall = time.perf_counter() - wall
+
+        result = {
+            "ops": self.args.iterations,
+            "errors": errors,
+            "ops_s": round(self.args.iterations / wall, 2),
+            **{key: value for key, value in histogram.summary().items() if key != "n"},
+            "edits_op": round(
+                (self.client.edit_count - edits_before) / self.args.iterations, 2
+            ),
+            "api_calls": sum(self.server.calls.values()) - sum(calls_before.values()),
+        }
+
+        if self.args.alloc:
+            allocated = sum(
+                stat.size_diff
+                for stat in tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+                if stat.size_diff > 0
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["kib_op"] = round(allocated / 1024 / self.args.iterations, 1)
+            result["peak_kib"] = round(peak / 1024, 1)
+
+        return result
+
+
+def _print_table(results: dict[str, dict]):
+    columns = list(next(iter(results.values())).keys())
+    print("handler".ljust(18) + "".join(col.rjust(10) for col in columns))
+    for handler, row in results.items():
+        print(handler.ljust(18) + "".join(str(row[col]).rjust(10) for col in columns))
+
+
+def _compare(results: dict, baseline_path: str, threshold: float) -> bool:
+    """Print deltas against a saved run, return True if anything regressed."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressed = False
+    print(f"\nvs {baseline_path} (threshold {threshold:.0%})")
+    for handler, row in results.items():
+        old = baseline.get(handler)
+        if not old:
+            continue
+        for key, worse_if_higher in (("p95", True), ("ops_s", False), ("kib_op", True)):
+            if key not in row or not old.get(key):
+                continue
+            delta = (row[key] - old[key]) / old[key]
+            bad = delta > threshold if worse_if_higher else -delta > threshold
+            regressed |= bad
+            flag = "  REGRESSION" if bad else ""
+            print(
+                f"  {handler:<18}{key:<8}{old[key]:>10} -> {row[key]:<10}"
+                f"{delta:+.1%}{flag}"
+            )
+    return regressed
+
+
+async def run(args) -> int:
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="plugins_bench_")
+    read_path = os.path.join(workdir, "notes.txt")
+    with open(read_path, "w", encoding="utf-8") as f:
+        f.write("bench file\n" * 50)
+
+    fallback = replay_responder(args.replay) if args.replay else synthetic_responder()
+
+    async with FakeGeminiServer(
+        responder=aigent_responder(read_path, fallback),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    ) as server:
+        bench = Bench(args, server, workdir)
+        bench.patch()
+
+        results = {}
+        for handler in args.handlers:
+            results[handler] = await bench.run_handler(handler)
+
+    _print_table(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and _compare(results, args.baseline, args.threshold):
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=30)
+    parser.add_argument("-c", "--concurrency", type=int, default=5)
+    parser.add_argument("--handlers", nargs="+", choices=HANDLERS, default=HANDLERS)
+    parser.add_argument("--latency", type=float, default=0.3, help="model latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--replay", help="JSONL of recorded generateContent responses")
+    parser.add_argument("--sm-messages", type=int, default=200)
+    parser.add_argument("--cache", action="store_true", help="keep response cache on")
+    parser.add_argument("--governor", action="store_true", help="keep real rate limits")
+    parser.add_argument("--no-alloc", dest="alloc", action="store_false")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Per-call cost of fresh vs pooled YoutubeDL objects for searches.
+
+Offline by default: every call resolves a synthetic flat search result,
+so only construction, option processing and teardown differ between the
+two modes. --online runs real ytsearch queries instead.
+
+Run from the bot root so ``app`` is importable:
+
+    python -m app.modules.bench.ytdl_pool -n 300 -c 4
+    python -m app.modules.bench.ytdl_pool --online -n 10 -c 2
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+
+from ..ytpool import YDL_PROFILES, YoutubeDLPool
+
+SEARCH_QUERIES = ("never gonna give you up", "bohemian rhapsody", "blinding lights")
+
+
+def synthetic_search(i: int) -> dict:
+    """A flat ytsearch result; resolving it needs no network."""
+    return {
+        "_type": "playlist",
+        "id": f"bench-{i}",
+        "title": "bench search",
+        "extractor": "youtube:search",
+        "extractor_key": "YoutubeSearch",
+        "webpage_url": f"ytsearch:bench {i}",
+        "entries": [
+            {
+                "_type": "url",
+                "ie_key": "Youtube",
+                "id": f"{i:011d}",
+                "url": f"https://www.youtube.com/watch?v={i:011d}",
+                "title": f"result {i}",
+            }
+        ],
+    }
+
+
+def make_workload(online: bool):
+    def search(ydl: yt_dlp.YoutubeDL, i: int):
+        if online:
+            query = SEARCH_QUERIES[i % len(SEARCH_QUERIES)]
+            return ydl.extract_info(f"ytsearch:{query}", download=False)
+        return ydl.process_ie_result(synthetic_search(i), download=False)
+
+    return search
+
+
+def run_mode(mode: str, args) -> dict:
+    from ..perf import Histogram
+
+    search = make_workload(args.online)
+    pool = YoutubeDLPool(YDL_PROFILES, args.concurrency)
+    histogram = Histogram()
+
+    def one(i: int):
+        start = time.perf_counter()
+        if mode == "fresh":
+            with yt_dlp.YoutubeDL(dict(YDL_PROFILES["search"])) as ydl:
+                search(ydl, i)
+        else:
+            with pool.checkout("search") as ydl:
+                search(ydl, i)
+        histogram.record(time.perf_counter() - start)
+
+    # Warm-up: extractor imports are shared and not part of either mode.
+    one(-1)
+    histogram = Histogram()
+
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.iterations)))
+    wall = time.perf_counter() - wall
+
+    return {
+        "ops_s": round(args.iterations / wall, 2),
+        **{key: value for key, value in histogram.summary().items() if key != "n"},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=4)
+    parser.add_argument("--online", action="store_true", help="real ytsearch calls")
+    args = parser.parse_args()
+
+    results = {mode: run_mode(mode, args) for mode in ("fresh", "pooled")}
+
+    columns = list(results["fresh"].keys())
+    print("mode".ljust(10) + "".join(col.rjust(10) for col in columns))
+    for mode, row in results.items():
+        print(mode.ljust(10) + "".join(str(row[col]).rjust(10) for col in columns))
+
+    fresh, pooled = results["fresh"]["p50"], results["pooled"]["p50"]
+    if pooled:
+        print(f"\np50 saving per call: {fresh - pooled:.2f} ms ({fresh / pooled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import re
+from collections import defaultdict
+
+# Word pieces of up to 4 characters plus single punctuation marks track
+# Gemini's SentencePiece counts closely enough for budgeting, without
+# a tokenizer dependency or an API round trip.
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+# Rough token cost for a non-text part (file, image, audio).
+MEDIA_TOKEN_ESTIMATE = 1000
+
+# Parts are never cut below this many tokens.
+MIN_PART_TOKENS = 256
+
+# Share of a truncated part kept from its start; the rest comes from the
+# end, which holds the newest chat lines and log entries.
+HEAD_SHARE = 0.4
+
+ELISION_MARKER = (
+    "\n\n[... {tokens} tokens ({lines} lines) elided to fit the input budget ...]\n\n"
+)
+
+
+def estimate_text_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text)) if text else 0
+
+
+_MARKER_TOKENS = estimate_text_tokens(ELISION_MARKER.format(tokens=99999, lines=9999))
+
+
+def estimate_tokens(contents) -> int:
+    """Token estimate for prompts, Content/Part objects or lists of them."""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return estimate_text_tokens(contents)
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(item) for item in contents)
+
+    parts = getattr(contents, "parts", None)
+    if parts is not None:
+        return estimate_tokens(parts)
+
+    text = getattr(contents, "text", None)
+    if isinstance(text, str):
+        return estimate_text_tokens(text)
+
+    function_response = getattr(contents, "function_response", None)
+    if function_response is not None:
+        return estimate_tokens(str(function_response.response))
+
+    return MEDIA_TOKEN_ESTIMATE
+
+
+def elide_middle(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of ``text`` within ``max_tokens``, mark the cut."""
+    tokens = estimate_text_tokens(text)
+    if tokens <= max_tokens:
+        return text
+
+    chars_per_token = len(text) / tokens
+    keep_chars = int(max_tokens * chars_per_token)
+    head_end = int(keep_chars * HEAD_SHARE)
+    tail_start = len(text) - (keep_chars - head_end)
+
+    # Snap to line boundaries so chat lines are not cut in half.
+    newline = text.rfind("\n", 0, head_end)
+    if newline > head_end // 2:
+        head_end = newline
+    newline = text.find("\n", tail_start)
+    if 0 <= newline < tail_start + (len(text) - tail_start) // 2:
+        tail_start = newline + 1
+
+    removed = text[head_end:tail_start]
+    marker = ELISION_MARKER.format(
+        tokens=estimate_text_tokens(removed), lines=removed.count("\n") + 1
+    )
+    return f"{text[:head_end]}{marker}{text[tail_start:]}"
+
+
+def fit_to_budget(prompts: list, budget: int) -> tuple[list, int, bool]:
+    """
+    Shrink the largest text parts until ``prompts`` fit ``budget`` tokens.
+
+    Returns the (possibly new) prompt list, its estimated token count and
+    whether anything was elided. Non-text parts are never touched, so the
+    result can still be over ``budget``.
+    """
+    sizes = [estimate_tokens(part) for part in prompts]
+    total = sum(sizes)
+    if total <= budget:
+        return prompts, total, False
+
+    prompts = list(prompts)
+    overflow = total - budget
+
+    text_parts = sorted(
+        (idx for idx, part in enumerate(prompts) if isinstance(part, str)),
+        key=lambda idx: sizes[idx],
+        reverse=True,
+    )
+    elided = False
+    for idx in text_parts:
+        if overflow <= 0:
+            break
+        target = max(MIN_PART_TOKENS, sizes[idx] - overflow - _MARKER_TOKENS)
+        if target >= sizes[idx]:
+            continue
+        prompts[idx] = elide_middle(prompts[idx], target)
+        new_size = estimate_text_tokens(prompts[idx])
+        overflow -= sizes[idx] - new_size
+        sizes[idx] = new_size
+        elided = True
+
+    return prompts, sum(sizes), elided
+
+
+class TokenLedger:
+    """Estimated input/output tokens per model across ask_ai calls."""
+
+    def __init__(self):
+        self._totals = defaultdict(
+            lambda: {"calls": 0, "in": 0, "out": 0, "elided": 0}
+        )
+
+    def record(
+        self, model_name: str, input_tokens: int, output_tokens: int, elided=False
+    ):
+        totals = self._totals[model_name]
+        totals["calls"] += 1
+        totals["in"] += input_tokens
+        totals["out"] += output_tokens
+        totals["elided"] += int(elided)
+
+    def stats(self) -> dict[str, dict]:
+        return {model_name: dict(totals) for model_name, totals in self._totals.items()}
+
+
+TOKENS = TokenLedger()
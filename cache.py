@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Size-bounded LRU mapping whose entries expire after a TTL.
+
+    A TTL of ``None`` keeps the entry until it is evicted by size,
+    a TTL <= 0 means the value is not stored at all.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float | None = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry)
+
+    @staticmethod
+    def _expired(entry: tuple) -> bool:
+        expires_at = entry[1]
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        if self._expired(entry):
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, ttl: float | None = ...):
+        if ttl is ...:
+            ttl = self.ttl
+
+        if ttl is not None and ttl <= 0:
+            return
+
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def purge_expired(self) -> int:
+        expired = [key for key, entry in self._data.items() if self._expired(entry)]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hit_rate, 3),
+        }
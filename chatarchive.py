@@ -0,0 +1,224 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from app import BOT, Message
+
+# ---------------------------------------------------------------------------
+# Local per-chat message archive backing .sm.
+#
+# One SQLite file per chat holds every message seen (id, date, sender,
+# text; text is empty for media without a caption). The archive always
+# covers one unbroken id range: it only grows forward from its newest id
+# and backward from its oldest, so a range query never misses messages
+# inside it. Retention trims the old end.
+# ---------------------------------------------------------------------------
+
+CHAT_ARCHIVE_DIR = os.path.join(os.getcwd(), "app", "plugins", "temp", "chat_archive")
+# Newest messages kept per chat, 0 keeps all.
+CHAT_ARCHIVE_MAX_MESSAGES = int(os.getenv("CHAT_ARCHIVE_MAX_MESSAGES", "5000"))
+# Messages older than this are dropped, 0 keeps them forever.
+CHAT_ARCHIVE_MAX_AGE = int(os.getenv("CHAT_ARCHIVE_MAX_AGE_DAYS", "30")) * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    date INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+
+def _row(message: Message) -> tuple[int, int, str, str]:
+    sender = "Unknown"
+    if message.from_user:
+        sender = message.from_user.first_name
+    elif message.sender_chat:
+        sender = message.sender_chat.title
+    text = (message.text or message.caption or "").replace("\n", " ")
+    date = int(message.date.timestamp()) if message.date else 0
+    return message.id, date, sender or "Unknown", text
+
+
+def format_lines(rows: list[tuple[str, str]]) -> list[str]:
+    return [f"[{sender}]: {text}" for sender, text in rows]
+
+
+class ChatArchive:
+    def __init__(self, root: str, max_messages: int, max_age: int):
+        self.root = root
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self._conns: dict[int, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self._sync_locks: dict[int, asyncio.Lock] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _db(self, chat_id: int) -> sqlite3.Connection:
+        # Callers hold self._lock.
+        conn = self._conns.get(chat_id)
+        if conn is None:
+            path = os.path.join(self.root, f"{chat_id}.sqlite3")
+            conn = sqlite3.connect(path, check_same_thread=False)
+            conn.executescript(SCHEMA)
+            self._conns[chat_id] = conn
+        return conn
+
+    def _bounds(self, chat_id: int) -> tuple[int | None, int | None, bool]:
+        """
+        Oldest and newest archived id, and whether the oldest is the first
+        message of the chat.
+        """
+        with self._lock:
+            db = self._db(chat_id)
+            low, high = db.execute("SELECT MIN(id), MAX(id) FROM messages").fetchone()
+            origin = db.execute(
+                "SELECT value FROM meta WHERE key = 'origin'"
+            ).fetchone()
+        return low, high, bool(origin and origin[0])
+
+    def _count_from(self, chat_id: int, min_id: int) -> int:
+        with self._lock:
+            db = self._db(chat_id)
+            return db.execute(
+                "SELECT COUNT(*) FROM messages WHERE id >= ?", (min_id,)
+            ).fetchone()[0]
+
+    def _store(
+        self, chat_id: int, rows: list[tuple], reset: bool = False, origin: bool = False
+    ):
+        with self._lock, self._db(chat_id) as db:
+            if reset:
+                db.execute("DELETE FROM messages")
+                db.execute("DELETE FROM meta")
+            db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?)", rows)
+            if origin:
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('origin', 1)")
+
+    def _prune(self, chat_id: int):
+        """Drop messages past the retention limits, from the old end only."""
+        with self._lock, self._db(chat_id) as db:
+            cutoff = None
+            if self.max_age:
+                row = db.execute(
+                    "SELECT MIN(id) FROM messages WHERE date >= ?",
+                    (int(time.time()) - self.max_age,),
+                ).fetchone()
+                # Everything is too old: drop it all.
+                cutoff = row[0] if row[0] is not None else float("inf")
+            if self.max_messages:
+                row = db.execute(
+                    "SELECT id FROM messages ORDER BY id DESC LIMIT 1 OFFSET ?",
+                    (self.max_messages - 1,),
+                ).fetchone()
+                if row:
+                    cutoff = max(cutoff or 0, row[0])
+            if cutoff is not None:
+                deleted = db.execute("DELETE FROM messages WHERE id < ?", (cutoff,))
+                if deleted.rowcount:
+                    db.execute("DELETE FROM meta WHERE key = 'origin'")
+
+    async def _history(self, bot: BOT, chat_id: int, **kwargs) -> list[tuple]:
+        return [_row(msg) async for msg in bot.get_chat_history(chat_id, **kwargs)]
+
+    async def sync(self, bot: BOT, chat_id: int, depth: int, min_id: int = 0):
+        """
+        Bring the archive up to date and make it reach back ``depth``
+        messages, or down to ``min_id`` if that is nearer.
+
+        New messages come from one history request bounded by the newest
+        archived id; older ones are only fetched if the archive doesn't
+        reach back far enough yet.
+        """
+        if self.max_messages:
+            depth = min(depth, self.max_messages)
+        lock = self._sync_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            await asyncio.to_thread(self._prune, chat_id)
+            low, high, origin = await asyncio.to_thread(self._bounds, chat_id)
+
+            if high is None:
+                rows = await self._history(bot, chat_id, limit=depth)
+                await asyncio.to_thread(
+                    self._store, chat_id, rows, reset=True, origin=len(rows) < depth
+                )
+                return
+
+            # min_id is inclusive in some pyrogram forks and exclusive in
+            # others; re-storing ``high`` is harmless.
+            cap = self.max_messages or None
+            rows = await self._history(bot, chat_id, min_id=high, limit=cap or 0)
+            new = [row for row in rows if row[0] > high]
+            # Hitting the cap may leave a hole after ``high``: start over.
+            reset = (
+                bool(cap) and len(rows) >= cap and min(row[0] for row in rows) > high
+            )
+            await asyncio.to_thread(self._store, chat_id, new, reset=reset)
+            if reset:
+                return
+
+            have = await asyncio.to_thread(self._count_from, chat_id, min_id)
+            if origin or have >= depth or low <= min_id:
+                return
+            # Ids below ``low`` down to ``min_id`` bound the count as well.
+            wanted = depth - have
+            if min_id:
+                wanted = min(wanted, low - min_id)
+            rows = await self._history(bot, chat_id, offset_id=low, limit=wanted)
+            rows = [row for row in rows if row[0] >= min_id]
+            await asyncio.to_thread(
+                self._store,
+                chat_id,
+                rows,
+                origin=not min_id and len(rows) < wanted,
+            )
+
+    def _query(self, sql: str, params: tuple, chat_id: int) -> list[tuple]:
+        with self._lock:
+            return self._db(chat_id).execute(sql, params).fetchall()
+
+    async def latest(self, chat_id: int, count: int) -> list[str]:
+        """
+        ``[sender]: text`` lines of the texts among the last ``count``
+        messages, oldest first.
+        """
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT sender, text FROM ("
+            " SELECT id, sender, text FROM messages ORDER BY id DESC LIMIT ?"
+            ") WHERE text != '' ORDER BY id",
+            (count,),
+            chat_id,
+        )
+        return format_lines(rows)
+
+    async def since(
+        self, chat_id: int, start_id: int, limit: int
+    ) -> tuple[list[str], bool]:
+        """
+        Lines of the texts from ``start_id`` on, at most the last ``limit``
+        messages, oldest first, and whether ``start_id`` was within them.
+        """
+        rows = await asyncio.to_thread(
+            self._query,
+            "SELECT id, sender, text FROM messages WHERE id >= ?"
+            " ORDER BY id DESC LIMIT ?",
+            (start_id, limit),
+            chat_id,
+        )
+        low, _, origin = await asyncio.to_thread(self._bounds, chat_id)
+        # Retention may have trimmed the archive above ``start_id``, and a
+        # full page may have cut off messages before it.
+        reaches = origin or (low is not None and low <= start_id)
+        found_start = reaches and (len(rows) < limit or rows[-1][0] == start_id)
+        lines = format_lines([(sender, text) for _, sender, text in rows if text])
+        return lines[::-1], found_start
+
+
+CHAT_ARCHIVE = ChatArchive(
+    CHAT_ARCHIVE_DIR, CHAT_ARCHIVE_MAX_MESSAGES, CHAT_ARCHIVE_MAX_AGE
+)
@@ -0,0 +1,184 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+
+from app import BOT, Message, bot
+
+from .perf import format_sections
+from .ytformat import UPLOAD_RATE
+
+# ---------------------------------------------------------------------------
+# Download scheduler shared by .ytdl, .fbdl and the ♫ button.
+# ---------------------------------------------------------------------------
+
+DL_GLOBAL_LIMIT = 3
+DL_CHAT_LIMIT = 1
+
+
+async def _notify(on_position: Callable[[int], Awaitable], position: int):
+    # A failed status edit must never fail or stall the download.
+    try:
+        await on_position(position)
+    except Exception:
+        pass
+
+
+class DownloadJob:
+    def __init__(self, key: str, chat_id: int, func: Callable[[], Awaitable]):
+        self.key = key
+        self.chat_id = chat_id
+        self.func = func
+        self.task: asyncio.Task | None = None
+        self.started = False
+        self.waiters = 0
+
+
+class DownloadScheduler:
+    """
+    FIFO download queue with a global and a per-chat concurrency cap.
+
+    Jobs with the same key are coalesced: later callers wait on the job
+    already queued or running. Results that hold resources (pinned cache
+    files) are handed out through ``share`` once per caller, and the
+    job's own hold is dropped with ``release`` after the last caller got
+    its share. A queued job is dropped once all its callers are gone, a
+    running one is left to finish into the cache.
+    """
+
+    def __init__(self, global_limit: int, chat_limit: int):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self._queue: list[DownloadJob] = []
+        self._jobs: dict[str, DownloadJob] = {}
+        self._active = 0
+        self._active_chats: dict[int, int] = defaultdict(int)
+        self._cond = asyncio.Condition()
+        self.started = 0
+        self.coalesced = 0
+
+    def _can_start(self, job: DownloadJob) -> bool:
+        if self._active >= self.global_limit:
+            return False
+        for queued in self._queue:
+            if self._active_chats.get(queued.chat_id, 0) < self.chat_limit:
+                return queued is job
+        return False
+
+    def _start(self, job: DownloadJob):
+        self._queue.remove(job)
+        self._active += 1
+        self._active_chats[job.chat_id] += 1
+        job.started = True
+        self.started += 1
+
+    async def _wait_turn(self, job: DownloadJob, on_position):
+        position = None
+        while True:
+            async with self._cond:
+                if self._can_start(job):
+                    self._start(job)
+                    return
+                current = self._queue.index(job) + 1
+
+            if current != position:
+                position = current
+                if on_position:
+                    await _notify(on_position, position)
+
+            async with self._cond:
+                if self._can_start(job):
+                    self._start(job)
+                    return
+                if self._queue.index(job) + 1 == position:
+                    await self._cond.wait()
+
+    async def _run(self, job: DownloadJob, on_position):
+        self._queue.append(job)
+        try:
+            await self._wait_turn(job, on_position)
+        except BaseException:
+            async with self._cond:
+                if job in self._queue:
+                    self._queue.remove(job)
+                self._cond.notify_all()
+            raise
+
+        try:
+            return await job.func()
+        finally:
+            async with self._cond:
+                self._active -= 1
+                self._active_chats[job.chat_id] -= 1
+                if not self._active_chats[job.chat_id]:
+                    del self._active_chats[job.chat_id]
+                self._cond.notify_all()
+
+    def _finish(self, job: DownloadJob, release):
+        """Drop the job's own hold once it is done and every caller left."""
+        if job.waiters or not job.task.done():
+            return
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        if release and not job.task.cancelled() and not job.task.exception():
+            release(job.task.result())
+
+    async def submit(
+        self,
+        key: str,
+        chat_id: int,
+        func: Callable[[], Awaitable],
+        share: Callable | None = None,
+        release: Callable | None = None,
+        on_position: Callable[[int], Awaitable] | None = None,
+    ):
+        """
+        Run ``func`` under the caps, or join the in-flight job for ``key``.
+
+        ``on_position`` is awaited with the 1-based queue position: on every
+        change for the caller that queued the job, once for later joiners.
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            job = DownloadJob(key, chat_id, func)
+            job.task = asyncio.create_task(self._run(job, on_position))
+            job.task.add_done_callback(lambda _: self._finish(job, release))
+            self._jobs[key] = job
+        else:
+            self.coalesced += 1
+
+        job.waiters += 1
+        try:
+            if on_position and job in self._queue:
+                await _notify(on_position, self._queue.index(job) + 1)
+            result = await asyncio.shield(job.task)
+            if share:
+                share(result)
+            return result
+        finally:
+            job.waiters -= 1
+            if not job.waiters and not job.started and not job.task.done():
+                job.task.cancel()
+            self._finish(job, release)
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queued": len(self._queue),
+            "chats": len(self._active_chats),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+DOWNLOADS = DownloadScheduler(DL_GLOBAL_LIMIT, DL_CHAT_LIMIT)
+
+
+@bot.add_cmd(cmd="dlq")
+async def download_queue_info(bot: BOT, message: Message):
+    """
+    CMD: DLQ
+    INFO: Shows running and queued downloads and the measured upload rate.
+    USAGE: .dlq
+    """
+    sections = {"downloads": DOWNLOADS.stats(), "upload_rate": UPLOAD_RATE.stats()}
+    await message.reply(format_sections(sections))
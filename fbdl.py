@@ -1,18 +1,105 @@
 import asyncio
+import json
+import os
 import re
-import shlex
-import shutil
-import tempfile
+import signal
+import time
+from collections import deque
 from pathlib import Path
 
-from pyrogram.types import ReplyParameters
-from ub_core import BOT, Message
-from ub_core.utils import run_shell_cmd, progress
+from pyrogram.types import InputMediaDocument, ReplyParameters
+from ub_core import BOT, LOGGER, Message
+from ub_core.utils import progress
 from ub_core.utils.downloader import DownloadedFile
 
+from .dlqueue import DOWNLOADS
+from .mediacache import MEDIA_CACHE
+from .progress import ProgressReporter, render_progress
+from .ytformat import (
+    FALLBACK_FORMAT,
+    UPLOAD_RATE,
+    select_video_format,
+    telegram_upload_limit,
+)
+from .ytpool import YDL_POOL
+
 # Regex to find Facebook URLs
 FB_URL_REGEX = r"https?://(?:www\.)?(?:m\.)?(?:facebook\.com|fb\.watch|fb\.com)\S*"
 
+FB_FORMAT = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+
+# Printed by yt-dlp for the finished file.
+FB_PRINT_TEMPLATE = "after_move:%(filepath)s"
+
+# Metadata from the planning pass, handed to yt-dlp so it doesn't extract
+# the link again. Hidden so it isn't taken for a download.
+FB_INFO_FILE = ".info.json"
+
+# One machine-readable stdout line per progress update, title last as it
+# may contain spaces.
+FB_PROGRESS_PREFIX = "FBDL-PROGRESS"
+FB_PROGRESS_TEMPLATE = (
+    f"download:{FB_PROGRESS_PREFIX} %(progress.downloaded_bytes)s"
+    " %(progress.total_bytes)s %(progress.total_bytes_estimate)s"
+    " %(progress.speed)s %(progress.eta)s %(info.title)s"
+)
+
+# Seconds without new bytes, output or growing files before yt-dlp is
+# killed; ffmpeg merges print nothing but keep writing.
+FB_STALL_TIMEOUT = 60
+# Hard limit for one yt-dlp run.
+FB_DOWNLOAD_TIMEOUT = 600
+# yt-dlp output lines kept for error messages.
+FB_OUTPUT_TAIL = 20
+
+# Planned formats may go up to this height, unlike .ytdl's 1080p cap.
+FB_MAX_HEIGHT = 2160
+
+# Files over the upload limit are cut into parts of about this share of
+# it; cuts land on keyframes, so parts vary in size.
+FB_SPLIT_HEADROOM = 0.9
+FB_SPLIT_ATTEMPTS = 3
+# Telegram albums hold at most this many files.
+FB_ALBUM_SIZE = 10
+
+# yt-dlp processes running at once, across all .fbdl batches.
+FB_DOWNLOAD_LIMIT = 3
+# Telegram uploads running at once, across all .fbdl batches.
+FB_UPLOAD_LIMIT = 2
+
+FB_DOWNLOAD_SLOTS = asyncio.Semaphore(FB_DOWNLOAD_LIMIT)
+FB_UPLOAD_SLOTS = asyncio.Semaphore(FB_UPLOAD_LIMIT)
+
+
+def fb_cache_key(link: str) -> str:
+    # Facebook ids can't be parsed from share links without an extraction,
+    # so the link itself stands in for the video id.
+    return MEDIA_CACHE.key("facebook", link, FB_FORMAT)
+
+
+def _number(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:  # "NA" for unknown fields
+        return None
+
+
+def render_batch(progress: dict[str, tuple]) -> str:
+    return "\n\n".join(
+        render_progress(f"Downloading {title[:40]}", done, total, speed, eta)
+        for title, done, total, speed, eta in progress.values()
+    )
+
+
+def _pin_files(result: tuple[dict[str, str], dict[str, str]]):
+    for file in result[0].values():
+        MEDIA_CACHE.pin(file)
+
+
+def _release_files(result: tuple[dict[str, str], dict[str, str]]):
+    for file in result[0].values():
+        MEDIA_CACHE.release(file)
+
 
 @BOT.add_cmd(cmd="fbdl")
 async def facebook_downloader(bot: BOT, message: Message):
@@ -46,92 +133,88 @@ async def facebook_downloader(bot: BOT, message: Message):
         f"Found {len(unique_links)} Facebook link(s). Starting download..."
     )
 
-    download_dir = Path(tempfile.mkdtemp(prefix="fbdl_"))
+    # Every path in here holds one pin, dropped in the finally below.
+    cached_files: list[str] = []
+    uploads: dict[str, asyncio.Task] = {}
+    # A started download outlives a cancelled command; its callbacks
+    # do nothing once this is set.
+    closed = False
 
-    try:
-        # Construct yt-dlp command
-        # -P sets output directory
-        # --restrict-filenames: restricts filenames to only ASCII characters
-        # --no-warnings --ignore-errors: suppresses non-critical output
-        # --no-playlist: prevents downloading entire playlists if a playlist link is given
-        # --format "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best": tries to get best quality MP4 with audio, fallback to best MP4, then general best
-        # --output "%(title)s.%(ext)s": sets output filename pattern
-        yt_dlp_command = [
-            "yt-dlp",
-            "-P",
-            str(download_dir),
-            "--restrict-filenames",
-            "--no-warnings",
-            "--ignore-errors",
-            "--no-playlist",
-            "--format",
-            "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
-            "--output",
-            "%(title)s.%(ext)s",
-            *unique_links,
-        ]
+    def start_upload(file: str):
+        if file not in uploads:
+            uploads[file] = asyncio.create_task(upload_file(bot, message, file))
 
-        await status_message.edit(
-            f"Downloading {len(unique_links)} video(s) using yt-dlp..."
-        )
+    pending_links = []
+    for link in unique_links:
+        hit = MEDIA_CACHE.lookup(fb_cache_key(link))
+        if hit:
+            cached_files.append(hit[0])
+            start_upload(hit[0])
+        else:
+            pending_links.append(link)
+
+    def on_file(link: str, file: str):
+        if closed:
+            return
+        # Upload while the rest of the batch is still downloading.
+        MEDIA_CACHE.pin(file)
+        cached_files.append(file)
+        download_progress.pop(link, None)
+        start_upload(file)
 
-        # Execute yt-dlp command
-        stdout = await run_shell_cmd(
-            cmd=shlex.join(yt_dlp_command), timeout=600
-        )  # Increased timeout for potentially large files
+    async def show_position(position: int):
+        await status_message.edit(f"Queued (#{position})...")
 
-        # Check if any files were downloaded
-        downloaded_files = list(download_dir.iterdir())
-        if not downloaded_files:
+    reporter = ProgressReporter(status_message)
+    download_progress: dict[str, tuple] = {}
+
+    def on_progress(link: str, *values):
+        if closed:
+            return
+        download_progress[link] = values
+        reporter.post(lambda: render_batch(download_progress))
+
+    try:
+        errors = {}
+        if pending_links:
             await status_message.edit(
-                f"Failed to download video(s) from the provided links. yt-dlp output:\n<pre>{stdout or 'No output'}</pre>",
+                f"Downloading {len(pending_links)} video(s) using yt-dlp..."
+                f" ({len(cached_files)} cached)"
+            )
+            files, errors = await DOWNLOADS.submit(
+                key="fbdl:" + " ".join(sorted(pending_links)),
+                chat_id=message.chat.id,
+                func=lambda: fetch_links(
+                    pending_links,
+                    on_file=on_file,
+                    on_error=lambda link, _: download_progress.pop(link, None),
+                    on_progress=on_progress,
+                ),
+                share=_pin_files,
+                release=_release_files,
+                on_position=show_position,
+            )
+            await reporter.wait()
+            # Joined batches get no on_file calls, upload everything here.
+            cached_files.extend(files.values())
+            for file in files.values():
+                start_upload(file)
+
+        for link, output in errors.items():
+            await message.reply(
+                f"Failed to download {link}. yt-dlp output:\n"
+                f"<pre>{output[-1000:]}</pre>",
                 parse_mode="html",
             )
+
+        if not uploads:
+            await status_message.edit("Failed to download any of the provided links.")
             return
 
         await status_message.edit(
-            f"Download complete. Uploading {len(downloaded_files)} file(s) to Telegram..."
+            f"Downloaded {len(uploads)} file(s), uploading to Telegram..."
         )
-
-        # Determine Telegram upload limit (2GB for non-premium, 4GB for premium)
-        max_tg_upload_size = 2 * 1024 * 1024 * 1024  # 2 GB
-        if bot.me.is_premium:
-            max_tg_upload_size = 4 * 1024 * 1024 * 1024  # 4 GB
-
-        for file_path in sorted(downloaded_files):  # Sort to ensure consistent order
-            if file_path.is_file():
-                try:
-                    file_info = DownloadedFile(file=file_path)
-
-                    file_size_bytes = file_path.stat().st_size
-                    if file_size_bytes > max_tg_upload_size:
-                        await message.reply(
-                            f"Skipping {file_info.name} as its size ({file_info.size:.2f} MB) exceeds Telegram's upload limit ({max_tg_upload_size / (1024 * 1024 * 1024):.0f} GB)."
-                        )
-                        continue
-
-                    upload_msg = await message.reply(f"Uploading: `{file_info.name}`")
-
-                    await bot.send_document(
-                        chat_id=message.chat.id,
-                        document=str(file_path),
-                        caption=file_info.name,
-                        reply_parameters=ReplyParameters(message_id=message.id),
-                        progress=progress,
-                        progress_args=(upload_msg, "Uploading...", str(file_path)),
-                        disable_content_type_detection=True,
-                    )
-                    await (
-                        upload_msg.delete()
-                    )  # Delete the "Uploading..." message after successful upload
-
-                except asyncio.CancelledError:
-                    await message.reply(f"Upload of {file_path.name} cancelled.")
-                    # Optionally, break the loop if all uploads should stop
-                    break
-                except Exception as e:
-                    await message.reply(f"Failed to upload {file_path.name}: {e}")
-                    # Continue with other files
+        await asyncio.gather(*uploads.values())
 
         await status_message.edit("All requested videos processed.", del_in=5)
 
@@ -142,5 +225,384 @@ async def facebook_downloader(bot: BOT, message: Message):
             f"An unexpected error occurred during processing: {e}"
         )
     finally:
-        if download_dir.exists():
-            shutil.rmtree(download_dir, ignore_errors=True)
+        closed = True
+        for task in uploads.values():
+            task.cancel()
+        await asyncio.gather(*uploads.values(), return_exceptions=True)
+        for file in cached_files:
+            MEDIA_CACHE.release(file)
+
+
+async def upload_file(bot: BOT, message: Message, file: str):
+    """
+    Send one file as a document under FB_UPLOAD_LIMIT, or as an album of
+    parts if it is over the Telegram upload limit, reporting failures.
+    """
+    file_path = Path(file)
+
+    # 2GB for non-premium, 4GB for premium
+    max_tg_upload_size = telegram_upload_limit()
+
+    try:
+        file_info = DownloadedFile(file=file_path)
+
+        file_size_bytes = file_path.stat().st_size
+        if file_size_bytes > max_tg_upload_size:
+            async with FB_UPLOAD_SLOTS:
+                await upload_split(bot, message, file_path, max_tg_upload_size)
+            return
+
+        async with FB_UPLOAD_SLOTS:
+            upload_msg = await message.reply(f"Uploading: `{file_info.name}`")
+
+            upload_start = time.perf_counter()
+            await bot.send_document(
+                chat_id=message.chat.id,
+                document=str(file_path),
+                caption=file_info.name,
+                reply_parameters=ReplyParameters(message_id=message.id),
+                progress=progress,
+                progress_args=(upload_msg, "Uploading...", str(file_path)),
+                disable_content_type_detection=True,
+            )
+            UPLOAD_RATE.record(file_size_bytes, time.perf_counter() - upload_start)
+            await (
+                upload_msg.delete()
+            )  # Delete the "Uploading..." message after successful upload
+
+    except asyncio.CancelledError:
+        await message.reply(f"Upload of {file_path.name} cancelled.")
+        raise
+    except Exception as e:
+        await message.reply(f"Failed to upload {file_path.name}: {e}")
+
+
+async def upload_split(bot: BOT, message: Message, file_path: Path, limit: int):
+    """Cut ``file_path`` into parts under ``limit`` and send them as albums."""
+    status = await message.reply(f"Splitting: `{file_path.name}`")
+    staging = MEDIA_CACHE.staging_dir()
+    try:
+        parts = await split_video(file_path, Path(staging), limit)
+        await status.edit(f"Uploading {len(parts)} parts of `{file_path.name}`...")
+
+        media = [
+            InputMediaDocument(
+                media=str(part), caption=f"{file_path.name} ({i}/{len(parts)})"
+            )
+            for i, part in enumerate(parts, start=1)
+        ]
+        albums = [
+            media[start : start + FB_ALBUM_SIZE]
+            for start in range(0, len(media), FB_ALBUM_SIZE)
+        ]
+        # An album needs at least two files.
+        if len(albums) > 1 and len(albums[-1]) == 1:
+            albums[-1].insert(0, albums[-2].pop())
+
+        upload_start = time.perf_counter()
+        for album in albums:
+            await bot.send_media_group(
+                chat_id=message.chat.id,
+                media=album,
+                reply_parameters=ReplyParameters(message_id=message.id),
+            )
+        UPLOAD_RATE.record(
+            file_path.stat().st_size, time.perf_counter() - upload_start
+        )
+        await status.delete()
+    finally:
+        MEDIA_CACHE.discard(staging)
+
+
+async def split_video(file_path: Path, out_dir: Path, limit: int) -> list[Path]:
+    """
+    Cut ``file_path`` into ordered parts of at most ``limit`` bytes with
+    ffmpeg's segment muxer. Streams are copied, not re-encoded; segment
+    length shrinks and the split is redone while a part is too large.
+    """
+    duration = await probe_duration(file_path)
+    segment_time = duration * limit * FB_SPLIT_HEADROOM / file_path.stat().st_size
+
+    for _ in range(FB_SPLIT_ATTEMPTS):
+        for part in out_dir.iterdir():
+            part.unlink()
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg",
+            "-v",
+            "error",
+            "-i",
+            str(file_path),
+            "-map",
+            "0:v",
+            "-map",
+            "0:a?",
+            "-c",
+            "copy",
+            "-f",
+            "segment",
+            "-segment_time",
+            f"{segment_time:.3f}",
+            "-reset_timestamps",
+            "1",
+            str(out_dir / f"part%03d{file_path.suffix}"),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace')}")
+
+        parts = sorted(out_dir.iterdir())
+        if parts and all(part.stat().st_size <= limit for part in parts):
+            return parts
+        segment_time *= 0.75
+
+    raise RuntimeError(f"Couldn't split {file_path.name} into parts under the limit")
+
+
+async def probe_duration(file_path: Path) -> float:
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration",
+        "-of",
+        "csv=p=0",
+        str(file_path),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    try:
+        return float(stdout)
+    except ValueError:
+        raise RuntimeError(
+            f"ffprobe failed: {stderr.decode(errors='replace')}"
+        ) from None
+
+
+def _plan_format(link: str, info_file: Path) -> str:
+    with YDL_POOL.checkout("video") as ydl:
+        info = ydl.extract_info(link, download=False)
+        info_file.write_text(json.dumps(ydl.sanitize_info(info)), encoding="utf-8")
+
+    spec, size = select_video_format(
+        info, budget=telegram_upload_limit(), max_height=FB_MAX_HEIGHT
+    )
+    if spec == FALLBACK_FORMAT:
+        # Nothing known to fit, the download is split before the upload.
+        return FB_FORMAT
+    LOGGER.info(f"fbdl {link}: format {spec}, ~{size} bytes")
+    return spec
+
+
+async def plan_format(link: str, info_file: Path) -> str:
+    """
+    Format spec for ``link`` whose size estimate from the metadata fits
+    the Telegram upload limit, or FB_FORMAT if none does or the metadata
+    can't be read. The metadata is saved to ``info_file`` if it was read.
+    """
+    try:
+        return await asyncio.to_thread(_plan_format, link, info_file)
+    except Exception as e:
+        LOGGER.info(f"fbdl {link}: planning failed, using {FB_FORMAT}: {e}")
+        return FB_FORMAT
+
+
+async def fetch_links(
+    links: list[str], on_file=None, on_error=None, on_progress=None
+) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Download every link in its own yt-dlp process, FB_DOWNLOAD_LIMIT at
+    a time.
+
+    Returns the pinned media cache path per finished link and the yt-dlp
+    output per failed one; one failure doesn't stop the others.
+    ``on_file(link, path)`` and ``on_error(link, output)`` are called as
+    soon as each link is done, ``on_progress`` is passed on to fetch_link.
+    """
+    files: dict[str, str] = {}
+    errors: dict[str, str] = {}
+
+    async def fetch(link: str):
+        try:
+            async with FB_DOWNLOAD_SLOTS:
+                files[link] = await fetch_link(link, on_progress)
+        except Exception as e:
+            errors[link] = str(e) or type(e).__name__
+            if on_error:
+                on_error(link, errors[link])
+            return
+        if on_file:
+            on_file(link, files[link])
+
+    try:
+        await asyncio.gather(*map(fetch, links))
+    except BaseException:
+        for file in files.values():
+            MEDIA_CACHE.release(file)
+        raise
+
+    return files, errors
+
+
+async def fetch_link(link: str, on_progress=None) -> str:
+    """
+    Download ``link`` with yt-dlp into a private staging dir.
+
+    ``on_progress(link, title, done, total, speed, eta)`` gets every
+    progress line yt-dlp prints. Returns the pinned media cache path of
+    the file, raises with the tail of the yt-dlp output if nothing was
+    downloaded.
+    """
+    download_dir = Path(MEDIA_CACHE.staging_dir())
+    try:
+        return await _fetch_into(link, download_dir, on_progress)
+    finally:
+        MEDIA_CACHE.discard(str(download_dir))
+
+
+async def _fetch_into(link: str, download_dir: Path, on_progress=None) -> str:
+    info_file = download_dir / FB_INFO_FILE
+    format_spec = await plan_format(link, info_file)
+    # Reuse the planning pass' metadata instead of extracting again.
+    if info_file.is_file():
+        source = ["--load-info-json", str(info_file)]
+    else:
+        source = [link]
+
+    # Construct yt-dlp command
+    # -P sets output directory
+    # --restrict-filenames: restricts filenames to only ASCII characters
+    # --no-warnings: suppresses non-critical output
+    # --no-playlist: prevents downloading entire playlists if a playlist link is given
+    # --format: the planned format, else FB_FORMAT "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best": tries to get best quality MP4 with audio, fallback to best MP4, then general best
+    # --output "%(title)s.%(ext)s": sets output filename pattern
+    # --print after_move:...: reports the path of the finished file
+    # --progress --newline --progress-template: one parsable line per
+    #   progress update, --print would silence it otherwise
+    # --load-info-json: the metadata from plan_format, else the link itself
+    yt_dlp_command = [
+        "yt-dlp",
+        "-P",
+        str(download_dir),
+        "--restrict-filenames",
+        "--no-warnings",
+        "--no-playlist",
+        "--format",
+        format_spec,
+        "--output",
+        "%(title)s.%(ext)s",
+        "--print",
+        FB_PRINT_TEMPLATE,
+        "--progress",
+        "--newline",
+        "--progress-template",
+        FB_PROGRESS_TEMPLATE,
+        *source,
+    ]
+
+    def on_line(line: str):
+        if not line.startswith(FB_PROGRESS_PREFIX):
+            return False
+        _, done, total, estimate, speed, eta, title = (line.split(" ", 6) + [""])[:7]
+        done = _number(done)
+        if on_progress:
+            on_progress(
+                link,
+                title or link,
+                done or 0,
+                _number(total) or _number(estimate),
+                _number(speed),
+                _number(eta),
+            )
+        return done
+
+    output = await run_ytdlp(yt_dlp_command, on_line, download_dir)
+
+    for line in reversed(output):
+        if Path(line).is_file():
+            # Move the finished file into the shared cache
+            return await asyncio.to_thread(
+                MEDIA_CACHE.commit,
+                fb_cache_key(link),
+                line,
+                {"title": Path(line).stem},
+            )
+    raise RuntimeError("\n".join(output) or "No output")
+
+
+def _dir_size(path: Path) -> int:
+    return sum(
+        entry.stat().st_size for entry in os.scandir(path) if entry.is_file()
+    )
+
+
+async def run_ytdlp(command: list[str], on_line, work_dir: Path) -> list[str]:
+    """
+    Run yt-dlp and feed its stdout lines to ``on_line`` as they arrive.
+
+    ``on_line`` returns the downloaded byte count for progress lines and
+    False for others, which are kept: the last FB_OUTPUT_TAIL of them are
+    returned. yt-dlp and its ffmpeg children are killed after
+    FB_STALL_TIMEOUT seconds without new bytes, output or growth of the
+    files in ``work_dir``, or after FB_DOWNLOAD_TIMEOUT in total.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        # Own process group, so a kill also reaches ffmpeg.
+        start_new_session=True,
+    )
+    output: deque[str] = deque(maxlen=FB_OUTPUT_TAIL)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + FB_DOWNLOAD_TIMEOUT
+    last_active = loop.time()
+    downloaded = 0
+    work_size = 0
+
+    try:
+        while True:
+            now = loop.time()
+            timeout = min(last_active + FB_STALL_TIMEOUT, deadline) - now
+            try:
+                raw = await asyncio.wait_for(process.stdout.readline(), timeout)
+            except asyncio.TimeoutError:
+                if loop.time() >= deadline:
+                    raise TimeoutError(
+                        f"yt-dlp took longer than {FB_DOWNLOAD_TIMEOUT}s"
+                    ) from None
+                # Post-processing (ffmpeg merge) prints nothing.
+                size = await asyncio.to_thread(_dir_size, work_dir)
+                if size != work_size:
+                    work_size = size
+                    last_active = loop.time()
+                    continue
+                raise TimeoutError(
+                    f"yt-dlp made no progress for {FB_STALL_TIMEOUT}s"
+                ) from None
+            if not raw:
+                break
+
+            line = raw.decode(errors="replace").rstrip()
+            done = on_line(line)
+            if done is False:
+                output.append(line)
+                last_active = loop.time()
+            elif done and done != downloaded:
+                # A merge download restarts from 0 for its second stream.
+                downloaded = done
+                last_active = loop.time()
+
+        await process.wait()
+    finally:
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+
+    return list(output)
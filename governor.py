@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+
+from app import BOT, Message, bot
+
+from .budget import estimate_tokens
+from .perf import format_sections
+
+# ---------------------------------------------------------------------------
+# Limits per model: (requests/min, tokens/min, concurrent calls)
+# Defaults follow the free tier, raise them for paid keys.
+# ---------------------------------------------------------------------------
+
+MODEL_LIMITS = {
+    "gemini-3-flash-preview": (10, 250_000, 4),
+    "gemini-3.1-flash-lite-preview": (15, 250_000, 4),
+    "gemini-2.5-pro": (5, 250_000, 2),
+    "gemini-2.5-flash": (10, 250_000, 4),
+    "gemini-2.5-flash-lite": (15, 250_000, 4),
+    "gemini-2.0-flash": (15, 1_000_000, 4),
+    "gemini-2.0-flash-lite": (30, 1_000_000, 4),
+}
+DEFAULT_LIMITS = (10, 250_000, 4)
+
+# Share of each bucket that background traffic may not touch, so a busy
+# autobot always leaves headroom for commands.
+BACKGROUND_RESERVE = 0.3
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class TokenBucket:
+    """Continuously refilling bucket sized to one minute of allowance."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay_for(self, amount: float, reserve: float = 0.0) -> float:
+        """Seconds until ``amount`` can be taken while keeping ``reserve`` share."""
+        self._refill()
+        amount = min(amount, self.capacity * (1 - reserve))
+        needed = amount + self.capacity * reserve - self.level
+        return 0.0 if needed <= 0 else needed / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Lane:
+    """Rate and concurrency gate for one (api key, model) pair."""
+
+    def __init__(self, rpm: int, tpm: int, concurrency: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = concurrency
+        self.active = 0
+        self._queue: list[list] = []  # heap of [priority, seq, tokens]
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def queue_depth(self) -> dict[str, int]:
+        depth = {priority.name.lower(): 0 for priority in Priority}
+        for priority, *_ in self._queue:
+            depth[Priority(priority).name.lower()] += 1
+        return depth
+
+    def _delay(self, priority: int, tokens: int) -> float:
+        reserve = BACKGROUND_RESERVE if priority == Priority.BACKGROUND else 0.0
+        return max(
+            self.requests.delay_for(1, reserve), self.tokens.delay_for(tokens, reserve)
+        )
+
+    async def acquire(self, priority: Priority, tokens: int) -> float:
+        entry = [int(priority), next(self._seq), tokens]
+        start = time.monotonic()
+
+        async with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    if self._queue[0] is entry and self.active < self.concurrency:
+                        delay = self._delay(priority, tokens)
+                        if delay <= 0:
+                            break
+                        # Wake early if a higher priority request arrives.
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), timeout=delay)
+                        except TimeoutError:
+                            pass
+                    else:
+                        await self._cond.wait()
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.active += 1
+            self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def settle(self, estimated: int, actual: int | None):
+        """Correct the token bucket once real usage is known."""
+        if not actual:
+            return
+        if actual > estimated:
+            self.tokens.consume(actual - estimated)
+        else:
+            self.tokens.refund(estimated - actual)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": self.queue_depth(),
+            "granted": self.granted,
+            "avg_wait": round(self.total_wait / self.granted, 2) if self.granted else 0,
+            "max_wait": round(self.max_wait, 2),
+            "rpm_left": int(self.requests.level),
+            "tpm_left": int(self.tokens.level),
+        }
+
+
+class Ticket:
+    def __init__(self, lane: Lane, tokens: int, waited: float):
+        self.lane = lane
+        self.tokens = tokens
+        self.waited = waited
+
+    def settle(self, usage_metadata):
+        actual = getattr(usage_metadata, "total_token_count", None)
+        self.lane.settle(self.tokens, actual)
+
+
+class Governor:
+    """Central rate limiter shared by every Gemini client in the plugins."""
+
+    def __init__(self):
+        self._lanes: dict[tuple[str, str], Lane] = {}
+
+    @staticmethod
+    def _key_id(api_key: str | None) -> str:
+        return hashlib.sha1((api_key or "").encode()).hexdigest()[:8]
+
+    def lane(self, api_key: str | None, model: str) -> Lane:
+        key = (self._key_id(api_key), model)
+        if key not in self._lanes:
+            self._lanes[key] = Lane(*MODEL_LIMITS.get(model, DEFAULT_LIMITS))
+        return self._lanes[key]
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        api_key: str | None,
+        model: str,
+        priority: Priority = Priority.INTERACTIVE,
+        contents=None,
+    ):
+        lane = self.lane(api_key, model)
+        tokens = estimate_tokens(contents)
+        waited = await lane.acquire(priority, tokens)
+        try:
+            yield Ticket(lane, tokens, waited)
+        finally:
+            await lane.release()
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            f"{key_id}/{model}": lane.stats()
+            for (key_id, model), lane in self._lanes.items()
+        }
+
+
+GOVERNOR = Governor()
+
+
+async def governed_generate(
+    client,
+    api_key: str | None,
+    priority: Priority = Priority.INTERACTIVE,
+    **kwargs,
+):
+    """``client.models.generate_content`` behind the shared governor."""
+    async with GOVERNOR.slot(
+        api_key, kwargs["model"], priority, kwargs.get("contents")
+    ) as ticket:
+        response = await client.models.generate_content(**kwargs)
+        ticket.settle(response.usage_metadata)
+    return response
+
+
+@bot.add_cmd(cmd="gov")
+async def governor_info(bot: BOT, message: Message):
+    """
+    CMD: GOV
+    INFO: Shows queue depth, waits and remaining quota per Gemini key/model.
+    USAGE: .gov
+    """
+    stats = GOVERNOR.stats()
+    if not stats:
+        await message.reply("no gemini calls yet.")
+        return
+
+    await message.reply(format_sections(stats))
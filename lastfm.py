@@ -1,5 +1,5 @@
 import os
-import asyncio
+import time
 from datetime import datetime
 
 from pyrogram import filters
@@ -19,7 +19,11 @@ from ub_core.core.handlers.dispatcher import make_custom_object
 from ub_core.core.types import CallbackQuery, InlineResult
 from ub_core.utils import aio, extract_user_data
 
-from .yt import get_ytm_link, ytdl_audio
+from .mediacache import MEDIA_CACHE
+from .prefetch import PREFETCH
+from .yt import download, get_ytm_link
+from .ytcache import save_file_id, send_cached
+from .ytformat import UPLOAD_RATE
 
 
 _bot: BOT = bot.bot
@@ -280,6 +284,7 @@ async def send_now_playing(
         link_preview_options=LinkPreviewOptions(is_disabled=True),
         reply_markup=markup,
     )
+    PREFETCH.schedule(yt_shortcode)
 
 
 @_bot.on_callback_query(filters=filters.regex("^y_"))
@@ -290,32 +295,63 @@ async def song_ytdl(bot: BOT, callback_query: CallbackQuery):
 
     caption = callback_query.message.text.html if callback_query.message else None
 
+    buttons = [
+        InlineKeyboardButton(text=f"{play_count} plays", callback_data="-_-"),
+        InlineKeyboardButton(text="↻", callback_data=f"r_{user_id}"),
+    ]
+    reply_markup = InlineKeyboardMarkup([buttons])
+
+    if await send_cached(
+        callback_query,
+        shortcode,
+        "audio",
+        caption=caption or "",
+        reply_markup=reply_markup,
+    ):
+        return
+
     audio_path = None
     try:
-        audio_path, info = await ytdl_audio(
-            f"https://music.youtube.com/watch?v={shortcode}"
+        async def show_position(position: int):
+            await callback_query.edit(f"<code>Queued (#{position})...</code>")
+
+        if callback_query.message:
+            chat_id = callback_query.message.chat.id
+        else:
+            chat_id = callback_query.from_user.id
+
+        # A prefetched track is already on disk, download() only looks it up.
+        await PREFETCH.claim(shortcode)
+        audio_path, info = await download(
+            f"https://music.youtube.com/watch?v={shortcode}",
+            "audio",
+            chat_id,
+            on_position=show_position,
         )
 
         await callback_query.edit("<code>ding! Uploading.</code>")
 
-        buttons = [
-            InlineKeyboardButton(text=f"{play_count} plays", callback_data="-_-"),
-            InlineKeyboardButton(text="↻", callback_data=f"r_{user_id}"),
-        ]
-        await callback_query.edit_media(
+        upload_start = time.perf_counter()
+        sent = await callback_query.edit_media(
             media=InputMediaAudio(
                 caption=caption,
                 media=audio_path,
                 parse_mode=ParseMode.HTML,
+                duration=int(info.get("duration") or 0),
+                performer=info.get("artist") or info.get("uploader"),
+                title=info.get("title"),
                 thumb=await aio.thumb_dl(info.get("thumbnail")),
             ),
-            reply_markup=InlineKeyboardMarkup([buttons]),
+            reply_markup=reply_markup,
+        )
+        UPLOAD_RATE.record(
+            os.path.getsize(audio_path), time.perf_counter() - upload_start
         )
+        await save_file_id(shortcode, "audio", sent, info)
     except Exception as e:
         await callback_query.edit(f"Failed: {e}")
     finally:
-        if audio_path and os.path.exists(audio_path):
-            await asyncio.to_thread(os.remove, audio_path)
+        MEDIA_CACHE.release(audio_path)
 
 
 @_bot.on_callback_query(filters=filters.regex("^r_"))
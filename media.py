@@ -0,0 +1,170 @@
+import time
+
+from google.genai.types import File, Part
+from pyrogram.enums import MessageMediaType
+from pyrogram.types.messages_and_media import Photo
+from ub_core import CustomDB
+from ub_core.utils import get_tg_media_details
+
+from app import LOGGER, Message
+from app.plugins.ai.gemini import async_client
+from app.plugins.ai.gemini.utils import upload_tg_file
+
+from .perf import span
+from .prompts import PROMPT_MAP
+
+# Media at or below this size is downloaded into memory and sent inline
+# with the request instead of going through a Files API upload first.
+INLINE_MEDIA_MAX_BYTES = 4 * 1024 * 1024
+
+INLINE_MIME_PREFIXES = ("image/", "audio/", "video/", "text/", "application/pdf")
+
+# Uploaded Gemini files keyed by Telegram file_unique_id.
+FILE_CACHE_DB = CustomDB["gemini_file_cache"]
+
+# Gemini deletes uploads after 48h; entries are dropped this long before.
+FILE_TTL = 48 * 3600
+FILE_EXPIRY_MARGIN = 2 * 3600
+
+# Cached files are re-checked with files.get at most this often.
+FILE_VALIDATE_AFTER = 30 * 60
+
+
+# Media that can be downloaded and sent to Gemini; link previews, polls,
+# locations, contacts and dice are left to the text prompt.
+FILE_MEDIA_TYPES = {
+    MessageMediaType.PHOTO,
+    MessageMediaType.VIDEO,
+    MessageMediaType.AUDIO,
+    MessageMediaType.VOICE,
+    MessageMediaType.DOCUMENT,
+    MessageMediaType.ANIMATION,
+    MessageMediaType.VIDEO_NOTE,
+    MessageMediaType.STICKER,
+}
+
+
+def get_media_message(message: Message | None) -> Message | None:
+    """The message holding media for a prompt: itself or the one it replies to."""
+    if message is None:
+        return None
+    if message.media in FILE_MEDIA_TYPES:
+        return message
+    replied = getattr(message, "replied", None)
+    if replied is not None and replied.media in FILE_MEDIA_TYPES:
+        return replied
+    return None
+
+
+def _mime_type(media) -> str:
+    if isinstance(media, Photo):
+        return "image/jpeg"
+    return getattr(media, "mime_type", None) or "application/octet-stream"
+
+
+def can_inline(media_message: Message) -> bool:
+    media = get_tg_media_details(media_message)
+    size = getattr(media, "file_size", 0) or 0
+    return 0 < size <= INLINE_MEDIA_MAX_BYTES and _mime_type(media).startswith(
+        INLINE_MIME_PREFIXES
+    )
+
+
+async def inline_part(media_message: Message) -> Part:
+    media = get_tg_media_details(media_message)
+    buffer = await media_message.download(in_memory=True)
+    return Part.from_bytes(data=buffer.getvalue(), mime_type=_mime_type(media))
+
+
+async def get_cached_file(unique_id: str) -> dict | None:
+    """Cached upload for a Telegram file, validated lazily against Gemini."""
+    entry = await FILE_CACHE_DB.find_one({"_id": unique_id})
+    if not entry:
+        return None
+
+    now = time.time()
+    if entry["expires_at"] - FILE_EXPIRY_MARGIN <= now:
+        await FILE_CACHE_DB.delete_data(id=unique_id)
+        return None
+
+    if now - entry.get("checked_at", 0) < FILE_VALIDATE_AFTER:
+        return entry
+
+    try:
+        file = await async_client.files.get(name=entry["name"])
+        state = file.state.name if file.state else "ACTIVE"
+    except Exception as e:
+        state = str(e)
+
+    if state != "ACTIVE":
+        LOGGER.info(f"Dropping cached gemini file {entry['name']}: {state}")
+        await FILE_CACHE_DB.delete_data(id=unique_id)
+        return None
+
+    entry["checked_at"] = now
+    await FILE_CACHE_DB.add_data(entry)
+    return entry
+
+
+async def cache_file(unique_id: str, uploaded: File):
+    now = time.time()
+    expiration = getattr(uploaded, "expiration_time", None)
+    await FILE_CACHE_DB.add_data(
+        {
+            "_id": unique_id,
+            "name": uploaded.name,
+            "uri": uploaded.uri,
+            "mime_type": uploaded.mime_type,
+            "expires_at": expiration.timestamp() if expiration else now + FILE_TTL,
+            "checked_at": now,
+        }
+    )
+
+
+async def media_part(media_message: Message, perf_cmd: str = "media") -> Part:
+    """
+    Gemini part for a Telegram media message.
+
+    A still valid upload of the same file is reused without downloading,
+    small media is sent as inline bytes and larger files go through the
+    Files API and are cached by file_unique_id. Each path is timed.
+    """
+    media = get_tg_media_details(media_message)
+    unique_id = getattr(media, "file_unique_id", None)
+
+    if unique_id:
+        with span(perf_cmd, "media_cache"):
+            cached = await get_cached_file(unique_id)
+        if cached:
+            return Part.from_uri(file_uri=cached["uri"], mime_type=cached["mime_type"])
+
+    if can_inline(media_message):
+        with span(perf_cmd, "media_inline"):
+            return await inline_part(media_message)
+
+    with span(perf_cmd, "media_upload"):
+        uploaded = await upload_tg_file(message=media_message, check_size=False)
+
+    if unique_id:
+        await cache_file(unique_id, uploaded)
+
+    return Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type)
+
+
+async def create_media_prompts(
+    message: Message, media_message: Message, perf_cmd: str = "media"
+) -> list:
+    """Prompt list for media: instruction text, caption and the media part."""
+    media = get_tg_media_details(media_message)
+
+    # Only command messages carry an instruction; the caption of a bare
+    # audio message being transcribed is sent as the caption below.
+    instruction = (
+        message.filtered_input if getattr(message, "cmd", None) else None
+    ) or PROMPT_MAP.get(type(media), "Summarize the file")
+
+    prompts = [instruction]
+    if media_message.caption:
+        prompts.append(f"[Caption]: {media_message.caption}")
+    prompts.append(await media_part(media_message, perf_cmd=perf_cmd))
+    return prompts
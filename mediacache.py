@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+
+from app import BOT, LOGGER, Message, bot
+
+from .perf import format_sections
+from .ytcache import FILE_ID_STATS, SEARCH_MEMORY, SEARCH_STATS
+
+# ---------------------------------------------------------------------------
+# Shared on-disk cache for downloaded media (yt-dlp jobs).
+#
+# Each entry is a directory named after a hash of (extractor, id, format)
+# holding the media file and an info.json sidecar. Downloads land in a
+# private staging dir and are renamed into place only once complete, and
+# entries pinned by an in-progress upload are never evicted.
+# ---------------------------------------------------------------------------
+
+MEDIA_CACHE_DIR = os.path.join(os.getcwd(), "app", "plugins", "temp", "media_cache")
+MEDIA_CACHE_QUOTA = int(os.getenv("MEDIA_CACHE_QUOTA_MB", "2048")) * 1024 * 1024
+
+# info.json keeps only what the handlers read back on a hit.
+INFO_FIELDS = ("id", "title", "ext", "duration", "thumbnail", "artist", "uploader")
+
+
+class MediaCache:
+    def __init__(self, root: str, quota: int):
+        self.root = root
+        self.quota = quota
+        self._pins: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(root, exist_ok=True)
+        # Leftovers from downloads interrupted by a restart.
+        for name in os.listdir(root):
+            if name.startswith("."):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+    @staticmethod
+    def key(extractor: str, video_id: str, fmt: str) -> str:
+        raw = f"{extractor.lower()}:{video_id}:{fmt}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _media_file(self, entry_dir: str) -> str | None:
+        for name in os.listdir(entry_dir):
+            if name != "info.json":
+                return os.path.join(entry_dir, name)
+        return None
+
+    def peek(self, key: str) -> bool:
+        """Whether ``key`` is cached, without pinning it or counting a hit."""
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            return os.path.isdir(entry_dir) and bool(self._media_file(entry_dir))
+
+    def lookup(self, key: str) -> tuple[str, dict] | None:
+        """Pinned (path, info) for a cached entry; release() it after use."""
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            path = self._media_file(entry_dir) if os.path.isdir(entry_dir) else None
+            if not path:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pins[key] += 1
+            os.utime(entry_dir)
+
+        try:
+            with open(os.path.join(entry_dir, "info.json"), encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            info = {}
+        return path, info
+
+    def staging_dir(self) -> str:
+        return tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+
+    def commit(self, key: str, file_path: str, info: dict) -> str:
+        """Atomically move a finished download into the cache, pinned."""
+        tmp_dir = tempfile.mkdtemp(prefix=".commit-", dir=self.root)
+        os.replace(file_path, os.path.join(tmp_dir, os.path.basename(file_path)))
+        with open(os.path.join(tmp_dir, "info.json"), "w", encoding="utf-8") as f:
+            json.dump({field: info.get(field) for field in INFO_FIELDS}, f)
+
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Another job committed the same media first, keep theirs.
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._pins[key] += 1
+            path = self._media_file(entry_dir)
+
+        self.evict()
+        return path
+
+    def _path_key(self, path: str | None) -> str | None:
+        if not path or os.path.dirname(os.path.dirname(path)) != self.root:
+            return None
+        return os.path.basename(os.path.dirname(path))
+
+    def pin(self, path: str | None):
+        """Extra pin for a path already handed out, for a second user."""
+        key = self._path_key(path)
+        if key:
+            with self._lock:
+                self._pins[key] += 1
+
+    def release(self, path: str | None):
+        """Unpin the entry holding ``path``; non-cache paths are ignored."""
+        key = self._path_key(path)
+        if not key:
+            return
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    def discard(self, staging: str):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry_dir, file))
+                for file in os.listdir(entry_dir)
+            )
+            entries.append((os.path.getmtime(entry_dir), size, name))
+        return entries
+
+    def evict(self):
+        """Drop least recently used, unpinned entries until under quota."""
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.quota:
+                    break
+                if self._pins.get(key):
+                    continue
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for _, _, key in self._entries():
+                if not self._pins.get(key):
+                    shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._entries()
+            pinned = len(self._pins)
+        total = self.hits + self.misses
+        return {
+            "entries": len(entries),
+            "used_mb": round(sum(size for _, size, _ in entries) / 1024**2, 1),
+            "quota_mb": round(self.quota / 1024**2),
+            "pinned": pinned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+MEDIA_CACHE = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_QUOTA)
+
+
+@bot.add_cmd(cmd="mcache")
+async def media_cache_info(bot: BOT, message: Message):
+    """
+    CMD: MCACHE
+    INFO: Shows hit rates of the download, file_id and search caches and ♫ prefetches.
+    FLAGS: -c to clear unpinned entries
+    USAGE: .mcache | .mcache -c
+    """
+    if "-c" in message.flags:
+        await bot.make_async(MEDIA_CACHE.clear)()
+        LOGGER.info("Media cache cleared.")
+        await message.reply("media cache cleared.", del_in=5)
+        return
+
+    # prefetch imports this module.
+    from .prefetch import PREFETCH
+
+    sections = {
+        "downloads": MEDIA_CACHE.stats(),
+        "file_ids": FILE_ID_STATS,
+        "searches": {**SEARCH_STATS, "in_memory": len(SEARCH_MEMORY)},
+        "prefetch": PREFETCH.stats(),
+    }
+    await message.reply(format_sections(sections))
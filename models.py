@@ -1,10 +1,22 @@
-from google.genai.types import GenerateContentConfig, ThinkingConfig
+import asyncio
+import hashlib
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable
 
-from app import Message
+from google.genai.types import GenerateContentConfig, Part, ThinkingConfig
+from pyrogram.enums import ParseMode
+
+from app import BOT, LOGGER, Message, bot, extra_config
 from app.plugins.ai.gemini import Response, async_client
 from app.plugins.ai.gemini.configs import SAFETY_SETTINGS, SEARCH_TOOLS
 from app.plugins.ai.gemini.utils import create_prompts
 
+from .budget import TOKENS, estimate_text_tokens, fit_to_budget
+from .cache import TTLCache
+from .governor import GOVERNOR, Priority, governed_generate
+from .media import create_media_prompts, get_media_message
+from .perf import format_sections, span
 from .prompts import SYSTEM_PROMPTS
 
 
@@ -69,6 +81,325 @@ CMD_MODEL_DICT = {
 }
 
 
+# Seconds a cached answer stays valid per model, 0 disables caching.
+CACHE_TTL = {
+    "LEAF": 0,
+    "DEFAULT": 300,
+    "THINK": 1800,
+    "QUICK": 3600,
+}
+
+# Commands that never read or write the response cache.
+NO_CACHE_CMDS = {"rx"}
+NO_CACHE_FLAG = "-nc"
+
+RESPONSE_CACHE = TTLCache(max_size=256)
+
+# Estimated input tokens allowed per model, larger prompts get their
+# biggest text parts elided in the middle.
+INPUT_TOKEN_BUDGET = {
+    "LEAF": 32_000,
+    "DEFAULT": 64_000,
+    "THINK": 200_000,
+    "QUICK": 32_000,
+}
+
+# Backup model fired when the primary passes its p95 latency. The backup
+# reuses the primary's config so persona and limits stay the same.
+HEDGE_MODELS = {
+    "LEAF": "QUICK",
+    "THINK": "DEFAULT",
+}
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 10.0
+HEDGE_MIN_DELAY = 2.0
+
+
+def _fingerprint(obj) -> bytes:
+    if isinstance(obj, bytes):
+        return obj
+    if isinstance(obj, str):
+        return obj.encode("utf-8", errors="ignore")
+    inline_data = getattr(obj, "inline_data", None)
+    if inline_data is not None and inline_data.data:
+        return inline_data.data
+    if hasattr(obj, "model_dump_json"):
+        return obj.model_dump_json(exclude_none=True).encode()
+    if isinstance(obj, (list, tuple)):
+        return b"\x00".join(_fingerprint(item) for item in obj)
+    return repr(obj).encode()
+
+
+def make_cache_key(model: str, config: GenerateContentConfig, prompts: list) -> str:
+    """Key a request on model name, config fingerprint and a prompt/media hash."""
+    config_hash = hashlib.sha1(_fingerprint(config)).hexdigest()
+    prompt_hash = hashlib.sha256(_fingerprint(prompts)).hexdigest()
+    return f"{model}:{config_hash}:{prompt_hash}"
+
+
+def _cache_allowed(message: Message | None, model_name: str) -> bool:
+    if CACHE_TTL.get(model_name, 0) <= 0:
+        return False
+    if message is None:
+        return True
+    if getattr(message, "cmd", None) in NO_CACHE_CMDS:
+        return False
+    return NO_CACHE_FLAG not in (getattr(message, "flags", None) or [])
+
+
+# Minimum seconds between progressive edits while streaming, keeps a
+# single message well under Telegram's edit flood limits.
+STREAM_EDIT_INTERVAL = 1.5
+
+
+class StreamEditor:
+    """Throttled progressive edits of a placeholder message."""
+
+    def __init__(self, message: Message, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._text = ""
+        self._last_edit = 0.0
+        self._last_sent = ""
+        self._task: asyncio.Task | None = None
+
+    @property
+    def started(self) -> bool:
+        return bool(self._text)
+
+    def push(self, text: str):
+        self._text = text
+        if self._task and not self._task.done():
+            return
+        if time.monotonic() - self._last_edit < self.interval:
+            return
+        self._task = asyncio.create_task(self._edit())
+
+    async def _edit(self):
+        text = self._text[:4000]
+        if not text.strip() or text == self._last_sent:
+            return
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit(
+                text=f"{text} ▌", parse_mode=ParseMode.DISABLED, disable_preview=True
+            )
+            self._last_sent = text
+        except Exception as e:
+            # Usually FloodWait or MessageNotModified, back off and let the
+            # final edit carry the full text.
+            LOGGER.debug(f"Stream edit skipped: {e}")
+            self._last_edit = time.monotonic() + self.interval
+
+    async def close(self):
+        """Wait for an in-flight edit so it can't land after the final one."""
+        if self._task and not self._task.done():
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls onto one shared task.
+
+    Every caller awaits the task through ``asyncio.shield`` so cancelling
+    one caller leaves the call running for the rest; the task is only
+    cancelled once its last waiter is gone.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, list] = {}  # key: [task, waiters]
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[[], Awaitable]):
+        call = self._calls.get(key)
+
+        if call is None:
+            call = [asyncio.create_task(func()), 0]
+            self._calls[key] = call
+            call[0].add_done_callback(lambda _: self._forget(key, call))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: str, call: list):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+AI_FLIGHTS = SingleFlight()
+
+
+class LatencyTracker:
+    """Rolling window of call latencies per model."""
+
+    def __init__(self, window: int = 200):
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self.hedges = defaultdict(int)
+        self.hedge_wins = defaultdict(int)
+
+    def record(self, model_name: str, seconds: float):
+        self._samples[model_name].append(seconds)
+
+    def percentile(self, model_name: str, q: float) -> float | None:
+        samples = self._samples.get(model_name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def hedge_delay(self, model_name: str) -> float:
+        if len(self._samples.get(model_name, ())) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, self.percentile(model_name, 95))
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            model_name: {
+                "count": len(samples),
+                "p50": round(self.percentile(model_name, 50), 2),
+                "p95": round(self.percentile(model_name, 95), 2),
+                "hedges": self.hedges[model_name],
+                "hedge_wins": self.hedge_wins[model_name],
+            }
+            for model_name, samples in self._samples.items()
+            if samples
+        }
+
+
+LATENCY = LatencyTracker()
+
+
+async def _timed(model_name: str, coro: Awaitable, keep_cancelled: bool = True):
+    """
+    Await ``coro`` and record its latency for ``model_name``, also when it
+    fails or is cancelled: a primary cancelled by the hedge still took at
+    least this long, dropping it would hide the slow tail from the p95. A
+    cancelled backup only ran for part of the primary's time, so it passes
+    ``keep_cancelled=False`` to keep the backup model's stats clean.
+    """
+    start = time.perf_counter()
+    try:
+        return await coro
+    except asyncio.CancelledError:
+        if not keep_cancelled:
+            start = None
+        raise
+    finally:
+        if start is not None:
+            LATENCY.record(model_name, time.perf_counter() - start)
+
+
+async def _run_hedged(
+    model_name: str,
+    primary: Callable[[], Awaitable],
+    backup: Callable[[], Awaitable],
+    should_hedge: Callable[[], bool] | None = None,
+):
+    """
+    Run primary, fire backup once primary passes its p95 (or fails).
+    First successful result wins, the other task is cancelled.
+    """
+    primary_task = asyncio.create_task(primary())
+    tasks = {primary_task}
+
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=LATENCY.hedge_delay(model_name))
+
+        if primary_task in done and not primary_task.exception():
+            return primary_task.result()
+
+        if not done and should_hedge is not None and not should_hedge():
+            return await primary_task
+
+        LATENCY.hedges[model_name] += 1
+        tasks.add(asyncio.create_task(backup()))
+        error = None
+
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception():
+                    error = task.exception()
+                    continue
+                if task is not primary_task:
+                    LATENCY.hedge_wins[model_name] += 1
+                return task.result()
+
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let a cancelled stream settle its last edit before the caller's.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _generate(
+    prompts: list, kwargs: dict, editor: StreamEditor | None = None
+) -> str:
+    if editor is not None:
+        return await _generate_stream(prompts, kwargs, editor)
+    response = await governed_generate(
+        async_client, extra_config.GEMINI_API_KEY, contents=prompts, **kwargs
+    )
+    return Response(response).quoted_text()
+
+
+async def _generate_stream(prompts: list, kwargs: dict, editor: StreamEditor) -> str:
+    chunks = []
+    last_chunk = content_chunk = None
+
+    try:
+        async with GOVERNOR.slot(
+            extra_config.GEMINI_API_KEY, kwargs["model"], Priority.INTERACTIVE, prompts
+        ) as ticket:
+            stream = await async_client.models.generate_content_stream(
+                contents=prompts, **kwargs
+            )
+            async for chunk in stream:
+                last_chunk = chunk
+                if chunk.candidates and chunk.candidates[0].content:
+                    content_chunk = chunk
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    editor.push("".join(chunks))
+
+            if last_chunk is not None:
+                ticket.settle(last_chunk.usage_metadata)
+    finally:
+        await editor.close()
+
+    full_text = "".join(chunks)
+    if content_chunk is None:
+        return full_text
+
+    # The last chunk carries finish reason and grounding metadata; fold the
+    # accumulated text into it so Response formats it like a normal reply.
+    # It may come without content (or without candidates, usage only), so
+    # the content is taken from the last chunk that had some.
+    final = last_chunk if last_chunk.candidates else content_chunk
+    content = content_chunk.candidates[0].content
+    content.parts = [Part.from_text(text=full_text)]
+    final.candidates[0].content = content
+
+    return Response(final).quoted_text()
+
+
 async def get_model_and_config(model_name: str | None = None) -> dict:
     if not model_name:
         model_name = "DEFAULT"
@@ -77,16 +408,44 @@ async def get_model_and_config(model_name: str | None = None) -> dict:
     return {"model": model, "config": config}
 
 
+async def get_hedge_model_and_config(model_name: str | None = None) -> dict | None:
+    """Backup kwargs for hedged calls: a cheaper model with the same config."""
+    backup_name = HEDGE_MODELS.get(model_name or "DEFAULT")
+    if not backup_name:
+        return None
+    kwargs = await get_model_and_config(model_name=model_name)
+    return {"model": getattr(ModelNames, backup_name), "config": kwargs["config"]}
+
+
 async def ask_ai(
     message: Message | None = None,
     model_name: str | None = None,
     prompt: str | list | None = None,
+    use_cache: bool = True,
+    stream_to: Message | None = None,
+    hedge: bool = True,
 ):
+    """
+    Generate a reply for a message or explicit prompt.
+
+    When ``stream_to`` is given the response is streamed and the message is
+    progressively edited; callers still do the final formatted edit.
+    Models listed in HEDGE_MODELS fire a backup request when slow.
+    """
+    perf_cmd = getattr(message, "cmd", None) or "ask_ai"
+
     try:
         if prompt:
             prompts = prompt if isinstance(prompt, list) else [prompt]
         else:
-            prompts = await create_prompts(message=message)
+            media_message = get_media_message(message)
+            with span(perf_cmd, "prompt"):
+                if media_message is not None:
+                    prompts = await create_media_prompts(
+                        message, media_message, perf_cmd=perf_cmd
+                    )
+                else:
+                    prompts = await create_prompts(message=message)
 
     except AssertionError:
         return
@@ -94,10 +453,79 @@ async def ask_ai(
     if not model_name and message and hasattr(message, "cmd"):
         model_name = CMD_MODEL_DICT.get(message.cmd)
 
+    model_name = model_name or "DEFAULT"
     kwargs = await get_model_and_config(model_name=model_name)
 
-    response = await async_client.models.generate_content(contents=prompts, **kwargs)
+    budget = INPUT_TOKEN_BUDGET.get(model_name, 32_000)
+    prompts, input_tokens, elided = fit_to_budget(prompts, budget)
+    if elided:
+        LOGGER.info(f"ask_ai: {perf_cmd} prompt elided to ~{input_tokens} tokens")
+    if input_tokens > budget:
+        # Media parts can't be shortened, the API has the final say.
+        LOGGER.warning(
+            f"ask_ai: {perf_cmd} prompt still ~{input_tokens} tokens,"
+            f" over the {budget} token budget"
+        )
+
+    request_key = make_cache_key(kwargs["model"], kwargs["config"], prompts)
+
+    cache_key = None
+    if use_cache and _cache_allowed(message, model_name):
+        cache_key = request_key
+        cached = RESPONSE_CACHE.get(cache_key)
+        if cached is not None:
+            return cached
+
+    backup_kwargs = await get_hedge_model_and_config(model_name) if hedge else None
+
+    async def generate() -> str:
+        editor = StreamEditor(stream_to) if stream_to is not None else None
+
+        def primary():
+            return _timed(model_name, _generate(prompts, kwargs, editor))
+
+        if not backup_kwargs:
+            return await primary()
+
+        def backup():
+            return _timed(
+                HEDGE_MODELS[model_name],
+                _generate(prompts, backup_kwargs),
+                keep_cancelled=False,
+            )
+
+        # Once the primary stream is visibly producing text, let it finish.
+        should_hedge = (lambda: not editor.started) if editor else None
+        return await _run_hedged(model_name, primary, backup, should_hedge)
+
+    with span(perf_cmd, "generate"):
+        text = await AI_FLIGHTS.do(request_key, generate)
+
+    TOKENS.record(model_name, input_tokens, estimate_text_tokens(text or ""), elided)
+
+    if cache_key and text and text.strip():
+        RESPONSE_CACHE.set(cache_key, text, ttl=CACHE_TTL[model_name])
+
+    return text
+
+
+@bot.add_cmd(cmd="aic")
+async def ai_cache_info(bot: BOT, message: Message):
+    """
+    CMD: AIC
+    INFO: Shows response cache, per-model latency and token stats for ask_ai.
+    FLAGS: -c to clear the cache
+    USAGE: .aic | .aic -c
+    """
+    if "-c" in message.flags:
+        RESPONSE_CACHE.clear()
+        await message.reply("ai cache cleared.", del_in=5)
+        return
 
-    response = Response(response)
+    sections = {"cache": RESPONSE_CACHE.stats()}
+    for model_name, model_stats in LATENCY.stats().items():
+        sections[f"{model_name} latency"] = model_stats
+    for model_name, token_stats in TOKENS.stats().items():
+        sections[f"{model_name} tokens"] = token_stats
 
-    return response.quoted_text()
+    await message.reply(format_sections(sections))
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from pyrogram.types import ReplyParameters
+
+from app import BOT, Message, bot
+
+RAW_SAMPLE_LIMIT = 20_000
+PERF_DUMP_FILE = os.path.join(os.getcwd(), "perf_samples.jsonl")
+
+
+class Histogram:
+    """
+    HDR-style latency histogram in microseconds.
+
+    Values are bucketed by power of two with 32 linear sub-buckets each,
+    so any reported percentile is within ~3% of the recorded value while
+    memory stays bounded no matter how many samples come in.
+    """
+
+    SUB_BITS = 5
+
+    def __init__(self):
+        self.counts: dict[tuple[int, int], int] = defaultdict(int)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _bucket(cls, value: int) -> tuple[int, int]:
+        shift = max(0, value.bit_length() - cls.SUB_BITS - 1)
+        return shift, value >> shift
+
+    def record(self, seconds: float):
+        value = max(0, int(seconds * 1_000_000))
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Value at percentile ``q`` in milliseconds."""
+        if not self.count:
+            return 0.0
+        target = max(1, round(q / 100 * self.count))
+        seen = 0
+        for shift, mantissa in sorted(self.counts):
+            seen += self.counts[(shift, mantissa)]
+            if seen >= target:
+                low = mantissa << shift
+                high = ((mantissa + 1) << shift) - 1
+                value = min(max((low + high) / 2, self.min), self.max)
+                return value / 1000
+        return self.max / 1000
+
+    def summary(self) -> dict:
+        return {
+            "n": self.count,
+            "p50": round(self.percentile(50), 1),
+            "p95": round(self.percentile(95), 1),
+            "p99": round(self.percentile(99), 1),
+            "max": round((self.max or 0) / 1000, 1),
+        }
+
+
+class PerfRecorder:
+    """Named spans per (command, stage) with a bounded raw sample log."""
+
+    def __init__(self):
+        self.histograms: dict[tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.samples: deque = deque(maxlen=RAW_SAMPLE_LIMIT)
+
+    def record(self, command: str, stage: str, seconds: float):
+        self.histograms[(command, stage)].record(seconds)
+        self.samples.append(
+            {
+                "ts": round(time.time(), 3),
+                "cmd": command,
+                "stage": stage,
+                "ms": round(seconds * 1000, 3),
+            }
+        )
+
+    @contextmanager
+    def span(self, command: str, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(command, stage, time.perf_counter() - start)
+
+    def report(self) -> dict[str, dict[str, dict]]:
+        report = defaultdict(dict)
+        for (command, stage), histogram in sorted(self.histograms.items()):
+            report[command][stage] = histogram.summary()
+        return dict(report)
+
+    def dump(self, path: str = PERF_DUMP_FILE) -> int:
+        with open(path, "w", encoding="utf-8") as f:
+            for sample in self.samples:
+                f.write(json.dumps(sample) + "\n")
+        return len(self.samples)
+
+    def clear(self):
+        self.histograms.clear()
+        self.samples.clear()
+
+
+PERF = PerfRecorder()
+span = PERF.span
+
+
+def format_values(stats: dict) -> str:
+    """``key=value`` pairs of a stats dict on one line."""
+    return " ".join(f"{key}={value}" for key, value in stats.items())
+
+
+def format_sections(sections: dict[str, dict]) -> str:
+    """Reply body of the stats commands: a bold name and its values per section."""
+    return "\n\n".join(
+        f"<b>{name}</b>\n<code>{format_values(stats)}</code>"
+        for name, stats in sections.items()
+    )
+
+
+@bot.add_cmd(cmd="perf")
+async def perf_report(bot: BOT, message: Message):
+    """
+    CMD: PERF
+    INFO: Shows p50/p95/p99 latency (ms) per command and stage.
+    FLAGS:
+        -d to dump raw samples as JSONL
+        -c to clear recorded samples
+    USAGE: .perf | .perf -d | .perf -c
+    """
+    if "-c" in message.flags:
+        PERF.clear()
+        await message.reply("perf samples cleared.", del_in=5)
+        return
+
+    if "-d" in message.flags:
+        count = await asyncio.to_thread(PERF.dump)
+        await bot.send_document(
+            chat_id=message.chat.id,
+            document=PERF_DUMP_FILE,
+            caption=f"<code>{count} samples</code>",
+            reply_parameters=ReplyParameters(message_id=message.id),
+        )
+        return
+
+    report = PERF.report()
+    if not report:
+        await message.reply("no samples recorded yet.")
+        return
+
+    lines = []
+    for command, stages in report.items():
+        lines.append(f"<b>{command}</b>")
+        for stage, summary in stages.items():
+            lines.append(f"  <code>{stage}: {format_values(summary)}</code>")
+
+    await message.reply("\n".join(lines))
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+
+from yt_dlp.utils import DownloadCancelled
+
+from app import LOGGER
+
+from .dlqueue import DOWNLOADS
+from .mediacache import MEDIA_CACHE
+from .yt import CACHE_PROFILES, audio_profile, ytdl_audio
+from .ytcache import get_file_id
+
+# ---------------------------------------------------------------------------
+# Speculative audio prefetch for the ♫ button of now-playing cards: the
+# track is downloaded into the media cache while nobody waits for it, so
+# a tap is served from disk.
+# ---------------------------------------------------------------------------
+
+AUDIO_PREFETCH = True
+# Concurrent prefetches; more cards while these run are not prefetched.
+PREFETCH_LIMIT = 1
+# A prefetched track not tapped within this window counts as wasted.
+PREFETCH_CLAIM_TTL = 60 * 60
+
+
+class PrefetchCancelled(DownloadCancelled):
+    msg = "Prefetch cancelled, real downloads are waiting"
+
+
+def downloads_busy() -> bool:
+    stats = DOWNLOADS.stats()
+    return bool(stats["queued"]) or stats["active"] >= DOWNLOADS.global_limit
+
+
+class AudioPrefetcher:
+    """
+    Low-priority background downloads of tracks likely to be requested.
+
+    A prefetch only starts while the download queue is idle and is
+    aborted from its progress hook as soon as real downloads queue up,
+    unless a tap has claimed it by then. ``claim`` hands a tap the
+    prefetch for its track, waiting for it if still running.
+    """
+
+    def __init__(self, limit: int = PREFETCH_LIMIT, ttl: float = PREFETCH_CLAIM_TTL):
+        self.limit = limit
+        self.ttl = ttl
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._claimed: set[str] = set()
+        # video_id -> (path, size, unclaimed deadline)
+        self._ready: dict[str, tuple[str, int, float]] = {}
+        self._counts = dict.fromkeys(
+            ("started", "completed", "cancelled", "failed", "skipped", "hits"), 0
+        )
+        self.fetched_bytes = 0
+        self.wasted_bytes = 0
+
+    def schedule(self, video_id: str):
+        """Start prefetching ``video_id`` if it is new and there is room."""
+        if not AUDIO_PREFETCH or not video_id:
+            return
+        self._expire()
+        if video_id in self._tasks or video_id in self._ready:
+            return
+        if len(self._tasks) >= self.limit or downloads_busy():
+            self._counts["skipped"] += 1
+            return
+        task = asyncio.create_task(self._fetch(video_id))
+        self._tasks[video_id] = task
+
+    async def _cached(self, video_id: str) -> bool:
+        if await get_file_id(video_id, "audio"):
+            return True
+        key = MEDIA_CACHE.key("youtube", video_id, CACHE_PROFILES[audio_profile()])
+        return MEDIA_CACHE.peek(key)
+
+    async def _fetch(self, video_id: str):
+        received = 0
+
+        def hook(status: dict):
+            nonlocal received
+            received = status.get("downloaded_bytes") or received
+            if video_id not in self._claimed and downloads_busy():
+                raise PrefetchCancelled()
+
+        try:
+            # A tap on these is served without a download anyway.
+            if await self._cached(video_id):
+                self._counts["skipped"] += 1
+                return
+            self._counts["started"] += 1
+            path, _ = await ytdl_audio(
+                f"https://music.youtube.com/watch?v={video_id}", progress_hook=hook
+            )
+        except PrefetchCancelled:
+            self._counts["cancelled"] += 1
+            self.wasted_bytes += received
+            return
+        except Exception as e:
+            LOGGER.warning(f"prefetch {video_id} failed: {e}")
+            self._counts["failed"] += 1
+            self.wasted_bytes += received
+            return
+        finally:
+            self._tasks.pop(video_id, None)
+
+        # Still pinned here, the file may be evicted once released.
+        size = os.path.getsize(path)
+        # Committed to the cache, the tap looks it up again.
+        MEDIA_CACHE.release(path)
+        self._counts["completed"] += 1
+        self.fetched_bytes += size
+        self._ready[video_id] = (path, size, time.monotonic() + self.ttl)
+
+    def _expire(self):
+        now = time.monotonic()
+        for video_id, (_, size, deadline) in list(self._ready.items()):
+            if deadline <= now:
+                del self._ready[video_id]
+                self.wasted_bytes += size
+
+    async def claim(self, video_id: str) -> bool:
+        """
+        Whether ``video_id`` was prefetched into the media cache, waiting
+        for a running prefetch. The prefetch is no longer cancelled once
+        claimed.
+        """
+        task = self._tasks.get(video_id)
+        if task:
+            self._claimed.add(video_id)
+            try:
+                await asyncio.shield(task)
+            finally:
+                self._claimed.discard(video_id)
+
+        self._expire()
+        ready = self._ready.pop(video_id, None)
+        # Evicted since, the tap downloads it again.
+        if not ready or not os.path.exists(ready[0]):
+            return False
+        self._counts["hits"] += 1
+        return True
+
+    def stats(self) -> dict:
+        self._expire()
+        completed = self._counts["completed"]
+        return {
+            **self._counts,
+            "running": len(self._tasks),
+            "waiting": len(self._ready),
+            "hit_rate": round(self._counts["hits"] / completed, 2) if completed else 0,
+            "fetched_mb": round(self.fetched_bytes / 1024**2, 1),
+            "wasted_mb": round(self.wasted_bytes / 1024**2, 1),
+        }
+
+
+PREFETCH = AudioPrefetcher()
+
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from collections.abc import Callable
+
+from app import Message
+
+# Minimum seconds between two edits of the same status message; Telegram
+# answers faster edits with FloodWait.
+PROGRESS_EDIT_INTERVAL = 4.0
+
+BAR_WIDTH = 10
+
+
+def _size(num_bytes: float) -> str:
+    return f"{num_bytes / 1024**2:.1f} MB"
+
+
+def _duration(seconds: float | None) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 60}m{seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+
+
+def render_progress(
+    phase: str, done: float, total: float | None, speed: float | None, eta: float | None
+) -> str:
+    lines = [f"<b>{phase}...</b>"]
+    if total:
+        ratio = min(done / total, 1.0)
+        filled = round(ratio * BAR_WIDTH)
+        bar = "■" * filled + "□" * (BAR_WIDTH - filled)
+        lines.append(f"<code>[{bar}] {ratio:.1%}</code>")
+        sizes = f"{_size(done)} / {_size(total)}"
+    else:
+        sizes = _size(done)
+    rate = f"{_size(speed)}/s" if speed else "?"
+    lines.append(f"<code>{sizes} @ {rate}, ETA {_duration(eta)}</code>")
+    return "\n".join(lines)
+
+
+class ProgressReporter:
+    """
+    One throttled status message for the download and upload phases.
+
+    ``ytdl_hook`` is a yt-dlp progress hook and runs in the make_async
+    worker thread; ``upload_progress`` is a pyrogram progress callback.
+    Both only hand finished text to the event loop, at most once per
+    PROGRESS_EDIT_INTERVAL and never while an edit is still in flight.
+    """
+
+    def __init__(self, message: Message, interval: float = PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._loop = asyncio.get_running_loop()
+        self._lock = threading.Lock()
+        self._last_edit = 0.0
+        self._editing = False
+        self._upload_start: float | None = None
+        self._task: asyncio.Task | None = None
+
+    def update(
+        self,
+        phase: str,
+        done: float,
+        total: float | None = None,
+        speed: float | None = None,
+        eta: float | None = None,
+    ):
+        """Thread-safe; drops the update if the last edit was too recent."""
+        self.post(lambda: render_progress(phase, done, total, speed, eta))
+
+    def post(self, render: Callable[[], str]):
+        """Like ``update`` for any text, ``render`` only runs if it is sent."""
+        now = time.monotonic()
+        with self._lock:
+            if self._editing or now - self._last_edit < self.interval:
+                return
+            self._editing = True
+            self._last_edit = now
+
+        self._loop.call_soon_threadsafe(self._start_edit, render())
+
+    def _start_edit(self, text: str):
+        self._task = self._loop.create_task(self._edit(text))
+
+    async def _edit(self, text: str):
+        try:
+            await self.message.edit(text)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._editing = False
+
+    def ytdl_hook(self, status: dict):
+        if status.get("status") != "downloading":
+            return
+        self.update(
+            "Downloading",
+            status.get("downloaded_bytes") or 0,
+            status.get("total_bytes") or status.get("total_bytes_estimate"),
+            status.get("speed"),
+            status.get("eta"),
+        )
+
+    async def upload_progress(self, current: int, total: int, *_):
+        now = time.monotonic()
+        if self._upload_start is None:
+            self._upload_start = now
+        elapsed = now - self._upload_start
+        speed = current / elapsed if elapsed > 0 else None
+        eta = (total - current) / speed if speed else None
+        self.update("Uploading", current, total, speed, eta)
+
+    async def wait(self):
+        """Let an in-flight edit land before the message is reused."""
+        while True:
+            if self._task and not self._task.done():
+                await asyncio.gather(self._task, return_exceptions=True)
+            elif self._editing:
+                # Posted from a worker thread, its task isn't created yet.
+                await asyncio.sleep(0)
+            else:
+                return
@@ -1,15 +1,44 @@
-from app import BOT, Message, bot
+import asyncio
+import time
+
+from app import BOT, LOGGER, Message, bot
 from pyrogram.enums import ParseMode
 
+from .budget import elide_middle, estimate_text_tokens
+from .chatarchive import CHAT_ARCHIVE
 from .models import ask_ai
+from .perf import PERF, span
+from .progress import ProgressReporter
 from app.plugins.ai.gemini.utils import run_basic_check
 
+# Most messages one .sm reads, for counts and reply ranges alike; the
+# archive retention caps it further.
+SM_MAX_MESSAGES = 5000
+
+# Longer chats are summarized map-reduce style: chunks of about this many
+# tokens are summarized on their own, then the partial summaries merged.
+SM_CHUNK_TOKENS = 16_000
+# Chunk summaries generated at once.
+SM_MAP_CONCURRENCY = 4
+
+MAP_INSTRUCTION = (
+    "This is part {part} of {parts} of a group chat conversation. Summarize"
+    " it as concise bullet points, keeping who said what, decisions, open"
+    " questions and notable facts:"
+)
+MAP_QUESTION_INSTRUCTION = (
+    "This is part {part} of {parts} of a group chat conversation. List"
+    " everything in it relevant to the following request, with who said it,"
+    " or reply 'nothing relevant'.\n\nRequest: {question}"
+)
+REDUCE_CONTEXT = "Context (summaries of consecutive parts of the chat, in order):"
+
 
 @bot.add_cmd(cmd="sm")
 @run_basic_check
 async def summ(bot: BOT, message: Message):
     """Summarizes chat messages using AI."""
-    limit = 200  # Default sanity limit
+    limit = SM_MAX_MESSAGES  # Default sanity limit
     count = 0
     start_msg_id = None
 
@@ -17,8 +46,8 @@ async def summ(bot: BOT, message: Message):
     if message.input and message.input.isdigit():
         # Case: Count argument provided (.sm 50)
         count = int(message.input)
-        if count > 500:
-            count = 500  # Hard cap
+        if count > SM_MAX_MESSAGES:
+            count = SM_MAX_MESSAGES  # Hard cap
     elif message.replied:
         # Case: Reply range
         start_msg_id = message.replied.id
@@ -31,88 +60,138 @@ async def summ(bot: BOT, message: Message):
 
     wait_msg = await message.reply("<code>Reading history...</code>")
 
-    chat_lines = []
+    history_start = time.perf_counter()
 
-    # 2. Fetch Messages Iterator
-    # If count is specified, we fetch the last N messages
+    # Bring the local archive up to date (usually one small history
+    # request), then read the range from it.
     if count:
-        async for msg in bot.get_chat_history(chat_id=message.chat.id, limit=count):
-            if not msg.text and not msg.caption:
-                continue
-
-            sender_name = "Unknown"
-            if msg.from_user:
-                sender_name = msg.from_user.first_name
-            elif msg.sender_chat:
-                sender_name = msg.sender_chat.title
-
-            content = (msg.text or msg.caption).replace("\n", " ")
-            chat_lines.append(f"[{sender_name}]: {content}")
-
-        # Reverse to chronological order as history returns newest first
-        chat_lines.reverse()
+        await CHAT_ARCHIVE.sync(bot, message.chat.id, depth=count)
+        chat_lines = await CHAT_ARCHIVE.latest(message.chat.id, count)
 
     # If using reply range
-    elif start_msg_id:
-        # We iterate history from current message backwards until we hit start_msg_id
-        # or hit the sanity limit.
-        temp_lines = []
-        found_start = False
-
-        async for msg in bot.get_chat_history(chat_id=message.chat.id, limit=limit):
-            # Stop if we went past the start message (in case ID check fails, which is rare)
-            if msg.id < start_msg_id:
-                break
-
-            if not msg.text and not msg.caption:
-                # Still check for break condition even if no text
-                if msg.id == start_msg_id:
-                    found_start = True
-                    break
-                continue
-
-            sender_name = "Unknown"
-            if msg.from_user:
-                sender_name = msg.from_user.first_name
-            elif msg.sender_chat:
-                sender_name = msg.sender_chat.title
-
-            content = (msg.text or msg.caption).replace("\n", " ")
-            line = f"[{sender_name}]: {content}"
-            temp_lines.append(line)
-
-            if msg.id == start_msg_id:
-                found_start = True
-                break
+    else:
+        await CHAT_ARCHIVE.sync(bot, message.chat.id, depth=limit, min_id=start_msg_id)
+        chat_lines, found_start = await CHAT_ARCHIVE.since(
+            message.chat.id, start_msg_id, limit
+        )
 
         if not found_start:
             # If we didn't find the start message within limit, let user know
             # But still summarize what we got
             await wait_msg.edit(f"Range too large, summarized last {limit} messages.")
 
-        # Reverse to get chronological order
-        chat_lines = temp_lines[::-1]
+    PERF.record("sm", "history", time.perf_counter() - history_start)
 
     if not chat_lines:
         await wait_msg.edit("No text content found to summarize.")
         return
 
+    question = None
+    if message.input and not message.input.isdigit() and not count:
+        question = message.input
+
     chat_history = "\n".join(chat_lines)
+    if estimate_text_tokens(chat_history) > SM_CHUNK_TOKENS:
+        chat_history = await map_summaries(message, wait_msg, chat_lines, question)
+        base_instruction = (
+            "Merge these summaries of consecutive parts of a group chat"
+            " conversation into one summary [use markdown]:"
+        )
+        context = REDUCE_CONTEXT
+    else:
+        base_instruction = (
+            "Summarize the following group chat conversation [use markdown]:"
+        )
+        context = "Context:"
+
     await wait_msg.edit("<code>Thinking...</code>")
 
     # 3. Prompt Construction & Flags
-    base_instruction = "Summarize the following group chat conversation [use markdown]:"
-
     full_prompt = (
         f"{base_instruction}\n\n[Start of Chat]\n{chat_history}\n[End of Chat]"
     )
 
-    if message.input and not message.input.isdigit():
-        if not count:
-            full_prompt = f"{message.input}\n\nContext:\n{chat_history}"
-
-    content = await ask_ai(message=message, model_name=None, prompt=full_prompt)
+    if question:
+        full_prompt = f"{question}\n\n{context}\n{chat_history}"
 
-    await wait_msg.edit(
-        text=content, parse_mode=ParseMode.MARKDOWN, disable_preview=True
+    content = await ask_ai(
+        message=message, model_name=None, prompt=full_prompt, stream_to=wait_msg
     )
+
+    with span("sm", "edit"):
+        await wait_msg.edit(
+            text=content, parse_mode=ParseMode.MARKDOWN, disable_preview=True
+        )
+
+
+def chunk_lines(lines: list[str], max_tokens: int) -> list[str]:
+    """Join ``lines`` into texts of at most ``max_tokens`` estimated tokens."""
+    chunks, current, current_tokens = [], [], 0
+    for line in lines:
+        tokens = estimate_text_tokens(line)
+        if tokens > max_tokens:
+            line = elide_middle(line, max_tokens)
+            tokens = estimate_text_tokens(line)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+async def map_summaries(
+    message: Message, wait_msg: Message, lines: list[str], question: str | None
+) -> str:
+    """
+    Summarize ``lines`` chunk by chunk, SM_MAP_CONCURRENCY at a time, and
+    return the partial summaries in chat order for the final reduce call.
+    Summaries that are still too long together are merged again first.
+    """
+    slots = asyncio.Semaphore(SM_MAP_CONCURRENCY)
+    reporter = ProgressReporter(wait_msg)
+    done = 0
+
+    async def summarize(chunk: str, part: int, parts: int) -> str:
+        nonlocal done
+        if question:
+            instruction = MAP_QUESTION_INSTRUCTION.format(
+                part=part, parts=parts, question=question
+            )
+        else:
+            instruction = MAP_INSTRUCTION.format(part=part, parts=parts)
+        prompt = f"{instruction}\n\n[Start of Chat]\n{chunk}\n[End of Chat]"
+        async with slots:
+            try:
+                summary = await ask_ai(message=message, prompt=prompt, hedge=False)
+            except Exception as e:
+                LOGGER.warning(f"sm: part {part}/{parts} failed: {e}")
+                summary = None
+        done += 1
+        reporter.post(lambda: f"<code>Summarizing parts ({done}/{parts})...</code>")
+        return f"[Part {part}/{parts}]\n{summary or '(could not be summarized)'}"
+
+    texts = lines
+    with span("sm", "map"):
+        while True:
+            chunks = chunk_lines(texts, SM_CHUNK_TOKENS)
+            done = 0
+            summaries = await asyncio.gather(
+                *(
+                    summarize(chunk, part, len(chunks))
+                    for part, chunk in enumerate(chunks, start=1)
+                )
+            )
+            merged = "\n\n".join(summaries)
+            # Stop once the summaries fit, or if merging stopped shrinking
+            # them; ask_ai elides whatever is still over its budget.
+            if (
+                len(summaries) == 1
+                or len(summaries) >= len(texts)
+                or estimate_text_tokens(merged) <= SM_CHUNK_TOKENS
+            ):
+                await reporter.wait()
+                return merged
+            texts = summaries
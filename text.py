@@ -4,6 +4,7 @@ from app import BOT, Message, bot
 from app.plugins.ai.gemini.utils import run_basic_check
 
 from .models import CMD_MODEL_DICT, ask_ai
+from .perf import span
 from .yt import get_ytm_link, ytdl_upload
 
 
@@ -16,12 +17,15 @@ async def r_question(bot: BOT, message: Message):
     else:
         loading_msg = await message.reply("<code>...</code>")
 
-    ai_text = await ask_ai(message=message, model_name=CMD_MODEL_DICT[message.cmd])
-
-    await loading_msg.edit(
-        text=ai_text, parse_mode=ParseMode.MARKDOWN, disable_preview=True
+    ai_text = await ask_ai(
+        message=message, model_name=CMD_MODEL_DICT[message.cmd], stream_to=loading_msg
     )
 
+    with span(message.cmd, "edit"):
+        await loading_msg.edit(
+            text=ai_text, parse_mode=ParseMode.MARKDOWN, disable_preview=True
+        )
+
 
 @bot.add_cmd(cmd="f")
 @run_basic_check
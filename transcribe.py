@@ -5,16 +5,21 @@ from pyrogram.enums import ParseMode
 from pyrogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from ub_core import BOT, Message, bot
 
-from .models import ask_ai
+from .models import AI_FLIGHTS, ask_ai
 
 _bot: BOT = bot.bot
 
 
 async def _transcribe_with_retry(message: Message, edit_msg: Message):
     """Attempts transcription with retry on failure."""
+    # Key on the audio message itself: a second tap joins the running
+    # upload + generation instead of starting its own.
+    flight_key = f"transcribe:{message.chat.id}:{message.id}"
     for _ in range(2):
         try:
-            transcribed_str = await ask_ai(message=message)
+            transcribed_str = await AI_FLIGHTS.do(
+                flight_key, lambda: ask_ai(message=message)
+            )
             await edit_msg.edit_text(
                 text=transcribed_str, parse_mode=ParseMode.MARKDOWN
             )
@@ -1,18 +1,43 @@
-import asyncio
 import os
-import tempfile
+import resource
+import time
 
-import yt_dlp
 from pyrogram.enums import ParseMode
-from pyrogram.types import InputMediaAudio, InputMediaVideo
+from pyrogram.types import ReplyParameters
 
-from app import Message, bot
+from app import LOGGER, Message, bot
 from app.plugins.misc.song import extract_link_from_reply
 
+from .dlqueue import DOWNLOADS
+from .mediacache import MEDIA_CACHE
+from .perf import PERF
+from .progress import ProgressReporter
+from .ytformat import UPLOAD_RATE, select_video_format
+from .ytcache import cached_search, save_file_id, send_cached, youtube_id
+from .ytpool import YDL_POOL
+from .ytstream import open_stream
+
+# YoutubeDL pool profile -> format profile, part of the media cache key.
+CACHE_PROFILES = {
+    "video": "video-auto",
+    "audio": "audio-native",
+    "audio_mp3": "audio-mp3-192",
+}
+
+# Keep YouTube's native audio stream when Telegram can play it; False
+# always transcodes to MP3 like before.
+AUDIO_FAST_PATH = True
+
 
 @bot.add_cmd(cmd="ytdl")
 async def ytdl_upload(bot, message: Message):
-    """Downloads and uploads YouTube video or audio."""
+    """
+    Downloads and uploads YouTube video or audio.
+
+    Small single-file videos are streamed from their URL straight into
+    the upload unless the media cache has them; everything else, audio
+    included, is downloaded to the media cache first.
+    """
     reply = message.replied
     link = extract_link_from_reply(reply) or message.input
 
@@ -21,96 +46,257 @@ async def ytdl_upload(bot, message: Message):
 
     response = await message.reply("<code>Processing...</code>")
 
-    try:
-        filename = None
-        force_audio = "-a" in message.flags
-        force_video = "-v" in message.flags
+    filename = None
+    force_audio = "-a" in message.flags
+    force_video = "-v" in message.flags
 
-        is_music_link = "music.youtube.com" in link
+    is_music_link = "music.youtube.com" in link
+    is_audio = force_audio or (is_music_link and not force_video)
+    kind = "audio" if is_audio else "video"
 
-        if force_audio or (is_music_link and not force_video):
-            filename, info = await ytdl_audio(link)
-            is_audio = True
-        else:
-            filename, info = await ytdl_video(link)
-            is_audio = False
+    video_id = youtube_id(link)
+    caption = "" if is_audio else None
+    if await send_cached(response, video_id, kind, caption=caption):
+        return
 
-        await response.edit("Uploading...")
+    async def show_position(position: int):
+        await response.edit(f"<code>Queued (#{position})...</code>")
 
+    # edit_media has no progress callback, so the file is sent as a new
+    # reply and the status message removed afterwards.
+    async def upload(media, info: dict, progress):
+        upload_kwargs = dict(
+            chat_id=message.chat.id,
+            reply_parameters=ReplyParameters(message_id=message.id),
+            progress=progress,
+        )
         if is_audio:
-            await response.edit_media(InputMediaAudio(media=filename))
-        else:
-            await response.edit_media(
-                InputMediaVideo(
-                    media=filename,
-                    caption=info.get("title", ""),
-                    parse_mode=ParseMode.HTML,
-                )
+            return await bot.send_audio(
+                audio=media,
+                duration=int(info.get("duration") or 0),
+                performer=info.get("artist") or info.get("uploader"),
+                title=info.get("title"),
+                **upload_kwargs,
             )
+        return await bot.send_video(
+            video=media,
+            caption=info.get("title", ""),
+            parse_mode=ParseMode.HTML,
+            **upload_kwargs,
+        )
+
+    reporter = ProgressReporter(response)
+
+    async def stream_job():
+        stream, info = await open_stream(link)
+        if not stream:
+            return None, info
+        try:
+            await response.edit("Streaming...")
+            sent = await upload(stream, info, stream.gate(reporter.upload_progress))
+            return sent, info
+        finally:
+            stream.close()
+
+    sent = info = None
+    if not is_audio and should_stream(link):
+        try:
+            sent, info = await DOWNLOADS.submit(
+                key=f"stream:{message.chat.id}:{message.id}",
+                chat_id=message.chat.id,
+                func=stream_job,
+                on_position=show_position,
+            )
+        except Exception as e:
+            LOGGER.warning(f"ytdl passthrough failed, downloading instead: {e}")
+            reporter = ProgressReporter(response)
+
+    if sent:
+        # The stream is paced by the YouTube fetch as well, so it doesn't
+        # feed UPLOAD_RATE.
+        await reporter.wait()
+        await response.delete()
+        await save_file_id(video_id, kind, sent, info)
+        return
+
+    try:
+        filename, info = await download(
+            link,
+            kind,
+            message.chat.id,
+            on_position=show_position,
+            progress_hook=reporter.ytdl_hook,
+            info=info,
+        )
+
+        await reporter.wait()
+        await response.edit("Uploading...")
+
+        upload_start = time.perf_counter()
+        sent = await upload(filename, info, reporter.upload_progress)
+
+        UPLOAD_RATE.record(
+            os.path.getsize(filename), time.perf_counter() - upload_start
+        )
+
+        await reporter.wait()
+        await response.delete()
+        await save_file_id(video_id, kind, sent, info)
 
     except Exception as e:
         await response.edit(f"Process failed: {str(e)}")
         return
 
     finally:
-        if filename and os.path.exists(filename):
-            await asyncio.to_thread(os.remove, filename)
+        MEDIA_CACHE.release(filename)
+
+
+async def download(
+    link: str,
+    kind: str,
+    chat_id: int,
+    on_position=None,
+    progress_hook=None,
+    info: dict | None = None,
+) -> tuple[str, dict]:
+    """
+    ytdl_audio / ytdl_video through the shared download queue.
+
+    Identical in-flight requests share one download, only the caller that
+    started it gets ``progress_hook`` calls. ``info`` from an earlier
+    extraction of ``link`` saves extracting it again. The returned path is
+    pinned in the media cache, pass it to ``MEDIA_CACHE.release`` after use.
+    """
+    func = ytdl_audio if kind == "audio" else ytdl_video
+    return await DOWNLOADS.submit(
+        key=f"{kind}:{youtube_id(link) or link}",
+        chat_id=chat_id,
+        func=lambda: func(link, progress_hook, info),
+        share=lambda result: MEDIA_CACHE.pin(result[0]),
+        release=lambda result: MEDIA_CACHE.release(result[0]),
+        on_position=on_position,
+    )
+
+
+def should_stream(link: str) -> bool:
+    """
+    Whether to try the video passthrough for ``link``: not when the media
+    cache already has the video.
+    """
+    video_id = youtube_id(link)
+    if video_id:
+        key = MEDIA_CACHE.key("youtube", video_id, CACHE_PROFILES["video"])
+        return not MEDIA_CACHE.peek(key)
+    return True
+
+
+def _cpu_time() -> float:
+    """CPU seconds of this thread plus reaped child processes (ffmpeg)."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.thread_time() + children.ru_utime + children.ru_stime
+
+
+def _cached_download(
+    url: str, ydl_profile: str, progress_hook=None, info: dict | None = None
+):
+    """
+    Download ``url`` through the shared media cache.
+
+    YouTube links are looked up by id before yt-dlp runs at all, other
+    sites after a metadata-only extraction. ``info`` from an earlier
+    extraction is processed directly instead of extracting again. Misses
+    are downloaded into a private staging dir and committed once complete.
+    The returned path is pinned until the caller passes it to
+    ``MEDIA_CACHE.release``.
+
+    Wall and CPU time of every download are recorded per path taken
+    (video, audio_remux, audio_transcode); the CPU figure includes
+    ffmpeg, and overlaps if several downloads finish at the same time.
+    """
+    cache_profile = CACHE_PROFILES[ydl_profile]
+    video_id = youtube_id(url)
+    if video_id:
+        key = MEDIA_CACHE.key("youtube", video_id, cache_profile)
+        hit = MEDIA_CACHE.lookup(key)
+        if hit:
+            return hit
+
+    staging = MEDIA_CACHE.staging_dir()
+    start, cpu_start = time.perf_counter(), _cpu_time()
+    try:
+        with YDL_POOL.checkout(
+            ydl_profile,
+            progress_hooks=[progress_hook] if progress_hook else None,
+            paths={"home": staging},
+        ) as ydl:
+            if video_id and ydl_profile != "video" and not info:
+                info = ydl.extract_info(url, download=True)
+            else:
+                info = info or ydl.extract_info(url, download=False)
+                if not video_id:
+                    extractor = info["extractor_key"]
+                    key = MEDIA_CACHE.key(extractor, info["id"], cache_profile)
+                    hit = MEDIA_CACHE.lookup(key)
+                    if hit:
+                        return hit
+                if ydl_profile == "video":
+                    spec, size = select_video_format(info)
+                    LOGGER.info(f"ytdl {info['id']}: format {spec}, ~{size} bytes")
+                    ydl.format_selector = ydl.build_format_selector(spec)
+                info = ydl.process_ie_result(info, download=True)
+
+            # Post-processors may change the extension, the final path is
+            # only known from the finished download.
+            downloads = info.get("requested_downloads") or [info]
+            path = downloads[0].get("filepath") or ydl.prepare_filename(info)
+
+        if ydl_profile == "video":
+            mode = "video"
+        elif path.endswith(".m4a"):
+            mode = "audio_remux"
+        else:
+            mode = "audio_transcode"
+        PERF.record("ytdl", f"{mode}_wall", time.perf_counter() - start)
+        PERF.record("ytdl", f"{mode}_cpu", _cpu_time() - cpu_start)
+
+        key = MEDIA_CACHE.key(info["extractor_key"], info["id"], cache_profile)
+        return MEDIA_CACHE.commit(key, path, info), info
+    finally:
+        MEDIA_CACHE.discard(staging)
 
 
 @bot.make_async
-def ytdl_video(url: str):
-    """Downloads YouTube video at 360p max quality."""
-    o = {
-        "format": "bestvideo[height<=360]+bestaudio/best[height<=360]",
-        "merge_output_format": "mp4",
-        "outtmpl": os.path.join(tempfile.gettempdir(), "%(title)s.%(ext)s"),
-        "quiet": True,
-        "no_warnings": True,
-    }
-    with yt_dlp.YoutubeDL(o) as ydl:
-        info = ydl.extract_info(url, download=True)
-        fn = ydl.prepare_filename(info)
-    return fn, info
+def ytdl_video(url: str, progress_hook=None, info: dict | None = None):
+    """
+    Downloads video in the best format that fits the Telegram limit and
+    uploads within VIDEO_UPLOAD_BUDGET at the measured upload rate.
+    """
+    return _cached_download(url, "video", progress_hook, info)
 
 
 @bot.make_async
-def ytdl_audio(url: str):
-    """Downloads YouTube audio as MP3."""
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": os.path.join(tempfile.gettempdir(), "%(title)s.%(ext)s"),
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }
-        ],
-        "quiet": True,
-        "no_warnings": True,
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
-        path = ydl.prepare_filename(info)
-        audio_path = os.path.splitext(path)[0] + ".mp3"
-    return audio_path, info
+def ytdl_audio(url: str, progress_hook=None, info: dict | None = None):
+    """Downloads YouTube audio as native M4A when available, otherwise MP3."""
+    return _cached_download(url, audio_profile(), progress_hook, info)
+
+
+def audio_profile() -> str:
+    return "audio" if AUDIO_FAST_PATH else "audio_mp3"
+
+
+async def get_ytm_link(song_name: str) -> str | None:
+    """Returns YouTube Music link for a song, searching only on a cache miss."""
+    video_id = await cached_search(song_name, search_ytm)
+    if video_id:
+        return f"https://music.youtube.com/watch?v={video_id}"
+    return None
 
 
 @bot.make_async
-def get_ytm_link(song_name: str) -> str | None:
-    """Searches YouTube Music and returns link for a song."""
-    ydl_opts = {
-        "quiet": True,
-        "skip_download": True,
-        "extract_flat": True,
-        "format": "bestaudio/best",
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        search_query = f"ytsearch:{song_name}"
-        info = ydl.extract_info(search_query, download=False)
-        if info.get("entries"):
-            video = info["entries"][0]
-            video_id = video.get("id")
-            if video_id:
-                return f"https://music.youtube.com/watch?v={video_id}"
+def search_ytm(song_name: str) -> str | None:
+    """Searches YouTube Music and returns the video id of the top result."""
+    with YDL_POOL.checkout("search") as ydl:
+        info = ydl.extract_info(f"ytsearch:{song_name}", download=False)
+    if info.get("entries"):
+        return info["entries"][0].get("id")
     return None
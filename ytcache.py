@@ -0,0 +1,158 @@
+import re
+import time
+import unicodedata
+from collections.abc import Awaitable, Callable
+
+from pyrogram.enums import ParseMode
+from pyrogram.types import InputMediaAudio, InputMediaVideo
+from ub_core import CustomDB
+
+from app import LOGGER, Message
+
+from .cache import TTLCache
+
+# ---------------------------------------------------------------------------
+# Telegram file_id reuse: once a track or video has been uploaded, Telegram
+# serves the same file again by id without any download or upload.
+# ---------------------------------------------------------------------------
+
+YT_FILE_DB = CustomDB["yt_file_ids"]
+
+YT_ID_REGEX = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)"
+    r"([\w-]{11})"
+)
+
+FILE_ID_STATS = {"hits": 0, "misses": 0, "invalidated": 0}
+
+
+def youtube_id(link: str | None) -> str | None:
+    """Video id from a YouTube / YouTube Music link, without calling yt-dlp."""
+    if not link:
+        return None
+    match = YT_ID_REGEX.search(link)
+    return match.group(1) if match else None
+
+
+def _file_key(video_id: str, kind: str) -> str:
+    return f"{video_id}:{kind}"
+
+
+async def get_file_id(video_id: str, kind: str) -> dict | None:
+    entry = await YT_FILE_DB.find_one({"_id": _file_key(video_id, kind)})
+    FILE_ID_STATS["hits" if entry else "misses"] += 1
+    return entry
+
+
+async def save_file_id(video_id: str, kind: str, sent: Message | None, info: dict):
+    """Remember the file_id of an uploaded audio/video message."""
+    media = getattr(sent, kind, None)
+    if not video_id or media is None:
+        # Inline messages return no Message from edit_media, nothing to store.
+        return
+
+    await YT_FILE_DB.add_data(
+        {
+            "_id": _file_key(video_id, kind),
+            "file_id": media.file_id,
+            "title": info.get("title", ""),
+            "duration": info.get("duration"),
+            "performer": info.get("artist") or info.get("uploader"),
+        }
+    )
+
+
+async def drop_file_id(video_id: str, kind: str):
+    FILE_ID_STATS["invalidated"] += 1
+    await YT_FILE_DB.delete_data(id=_file_key(video_id, kind))
+
+
+async def send_cached(
+    target, video_id: str | None, kind: str, caption: str | None = None, **kwargs
+) -> bool:
+    """
+    Edit ``target`` into the cached audio/video for ``video_id``.
+
+    Returns False on a miss or when Telegram rejects the stored file_id,
+    in which case the entry is dropped and the caller falls back to
+    downloading.
+    """
+    if not video_id:
+        return False
+
+    entry = await get_file_id(video_id, kind)
+    if not entry:
+        return False
+
+    media_cls = InputMediaAudio if kind == "audio" else InputMediaVideo
+    try:
+        await target.edit_media(
+            media_cls(
+                media=entry["file_id"],
+                caption=entry["title"] if caption is None else caption,
+                parse_mode=ParseMode.HTML,
+            ),
+            **kwargs,
+        )
+        return True
+    except Exception as e:
+        LOGGER.info(f"Cached file_id for {video_id}:{kind} rejected: {e}")
+        await drop_file_id(video_id, kind)
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Search results: normalised query -> video id, kept in memory and in the db
+# so repeated now-playing refreshes skip the YouTube search entirely.
+# ---------------------------------------------------------------------------
+
+YT_SEARCH_DB = CustomDB["ytm_search_cache"]
+
+SEARCH_TTL = 7 * 24 * 3600
+# Queries with no result are retried sooner, the track may get uploaded.
+SEARCH_NEGATIVE_TTL = 6 * 3600
+
+SEARCH_MEMORY = TTLCache(max_size=512, ttl=SEARCH_TTL)
+
+SEARCH_STATS = {"memory_hits": 0, "db_hits": 0, "searches": 0}
+
+
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", query).split())
+
+
+async def cached_search(
+    query: str, search: Callable[[str], Awaitable[str | None]]
+) -> str | None:
+    """
+    Video id for ``query``, running ``search`` only on a cache miss.
+
+    Empty results are cached for SEARCH_NEGATIVE_TTL, failed searches
+    raise and are not cached at all.
+    """
+    key = normalize_query(query)
+    if not key:
+        return None
+
+    video_id = SEARCH_MEMORY.get(key)
+    if video_id is not None:
+        SEARCH_STATS["memory_hits"] += 1
+        return video_id or None
+
+    now = time.time()
+    entry = await YT_SEARCH_DB.find_one({"_id": key})
+    if entry and entry["expires_at"] > now:
+        SEARCH_STATS["db_hits"] += 1
+        SEARCH_MEMORY.set(key, entry["video_id"], ttl=entry["expires_at"] - now)
+        return entry["video_id"] or None
+
+    SEARCH_STATS["searches"] += 1
+    video_id = await search(query)
+
+    ttl = SEARCH_TTL if video_id else SEARCH_NEGATIVE_TTL
+    SEARCH_MEMORY.set(key, video_id or "", ttl=ttl)
+    await YT_SEARCH_DB.add_data(
+        {"_id": key, "video_id": video_id or "", "expires_at": now + ttl}
+    )
+    return video_id
@@ -0,0 +1,149 @@
+import statistics
+import threading
+from collections import deque
+
+from app import bot
+
+# ---------------------------------------------------------------------------
+# Video format selection: the best quality whose estimated size fits the
+# Telegram limit and an upload time budget at the measured upload rate.
+# ---------------------------------------------------------------------------
+
+# Seconds an upload may take at the current rate.
+VIDEO_UPLOAD_BUDGET = 180
+MAX_VIDEO_HEIGHT = 1080
+
+# Used until enough uploads have been measured.
+DEFAULT_UPLOAD_RATE = 1.5 * 1024 * 1024
+UPLOAD_RATE_WINDOW = 20
+MIN_UPLOAD_SAMPLES = 3
+# Smaller uploads are dominated by round trips, not throughput.
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+FALLBACK_FORMAT = "worst[ext=mp4]/worst"
+
+
+class UploadRate:
+    """Median bytes/s over the most recent Telegram uploads."""
+
+    def __init__(self, window: int = UPLOAD_RATE_WINDOW):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, size: int, seconds: float):
+        if size < MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        with self._lock:
+            self._samples.append(size / seconds)
+
+    def estimate(self) -> float:
+        with self._lock:
+            if len(self._samples) < MIN_UPLOAD_SAMPLES:
+                return DEFAULT_UPLOAD_RATE
+            return statistics.median(self._samples)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = len(self._samples)
+        return {"samples": samples, "mb_s": round(self.estimate() / 1024**2, 2)}
+
+
+UPLOAD_RATE = UploadRate()
+
+
+def telegram_upload_limit() -> int:
+    me = getattr(bot, "me", None)
+    return (4 if me and me.is_premium else 2) * 1024**3
+
+
+def estimate_size(fmt: dict, duration: float | None) -> int | None:
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+    if fmt.get("tbr") and duration:
+        return int(fmt["tbr"] * 1000 / 8 * duration)
+    return None
+
+
+def _has(fmt: dict, stream: str) -> bool:
+    return fmt.get(stream) not in (None, "none")
+
+
+def _rank(fmt: dict) -> tuple:
+    # Prefer H.264 in MP4, which every Telegram client plays inline.
+    return (
+        fmt.get("height") or 0,
+        fmt.get("ext") == "mp4",
+        str(fmt.get("vcodec")).startswith("avc1"),
+        fmt.get("tbr") or 0,
+    )
+
+
+def select_video_format(
+    info: dict, budget: float | None = None, max_height: int = MAX_VIDEO_HEIGHT
+) -> tuple[str, int | None]:
+    """
+    yt-dlp format spec for ``info`` and its estimated size.
+
+    Progressive formats (audio and video in one file) need no ffmpeg
+    merge and win unless a merged pair reaches a higher resolution.
+    ``budget`` replaces the upload time budget as the size limit.
+    """
+    duration = info.get("duration")
+    if budget is None:
+        budget = min(
+            telegram_upload_limit(), UPLOAD_RATE.estimate() * VIDEO_UPLOAD_BUDGET
+        )
+
+    def fits(size: int | None) -> bool:
+        return size is not None and size <= budget
+
+    formats = [
+        fmt
+        for fmt in info.get("formats") or []
+        if (fmt.get("height") or 0) <= max_height
+        and fmt.get("protocol") != "mhtml"
+    ]
+
+    progressive = [
+        (fmt, estimate_size(fmt, duration))
+        for fmt in formats
+        if _has(fmt, "vcodec") and _has(fmt, "acodec")
+    ]
+    progressive = [(fmt, size) for fmt, size in progressive if fits(size)]
+    best_single = max(progressive, key=lambda item: _rank(item[0]), default=None)
+
+    # M4A audio so merged pairs stay muxable into MP4.
+    audio = [
+        (fmt, estimate_size(fmt, duration))
+        for fmt in formats
+        if _has(fmt, "acodec") and not _has(fmt, "vcodec") and fmt.get("ext") == "m4a"
+    ]
+    audio = [(fmt, size) for fmt, size in audio if size is not None]
+    best_pair = None
+    if audio:
+        audio_fmt, audio_size = max(audio, key=lambda item: item[0].get("abr") or 0)
+        pairs = []
+        for fmt in formats:
+            video_only = _has(fmt, "vcodec") and not _has(fmt, "acodec")
+            if not video_only or fmt.get("ext") != "mp4":
+                continue
+            size = estimate_size(fmt, duration)
+            if size is not None and fits(size + audio_size):
+                pairs.append((fmt, size + audio_size))
+
+        best_video = max(pairs, key=lambda item: _rank(item[0]), default=None)
+        if best_video:
+            video_fmt, size = best_video
+            best_pair = (
+                f"{video_fmt['format_id']}+{audio_fmt['format_id']}",
+                size,
+                video_fmt.get("height") or 0,
+            )
+
+    single_height = (best_single[0].get("height") or 0) if best_single else -1
+    if best_pair and best_pair[2] > single_height:
+        return best_pair[0], best_pair[1]
+    if best_single:
+        return best_single[0]["format_id"], best_single[1]
+    return FALLBACK_FORMAT, None
@@ -0,0 +1,143 @@
+import queue
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import yt_dlp
+
+# ---------------------------------------------------------------------------
+# Reusable YoutubeDL instances per option profile. Building one registers
+# every extractor and parses the options, and closing it drops cookies and
+# pooled connections, so instances are kept and handed out one at a time.
+# ---------------------------------------------------------------------------
+
+YDL_PROFILES = {
+    "search": {
+        "quiet": True,
+        "skip_download": True,
+        "extract_flat": True,
+        "format": "bestaudio/best",
+    },
+    # The download format is picked per job by select_video_format, this
+    # selector only has to match something during the metadata pass.
+    "video": {
+        "format": "bestvideo*+bestaudio/best",
+        "merge_output_format": "mp4",
+        "outtmpl": "%(title)s.%(ext)s",
+        "quiet": True,
+        "no_warnings": True,
+    },
+    # Keeps YouTube's native AAC stream (remux only) and transcodes to MP3
+    # only when the best audio is in a container Telegram won't play.
+    "audio": {
+        "format": "bestaudio[ext=m4a]/bestaudio/best",
+        "outtmpl": "%(title)s.%(ext)s",
+        "writethumbnail": True,
+        "postprocessors": [
+            {"key": "FFmpegThumbnailsConvertor", "format": "jpg", "when": "before_dl"},
+            {
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": "m4a>m4a/mp3>mp3/mp3",
+                "preferredquality": "192",
+            },
+            {"key": "FFmpegMetadata", "add_metadata": True},
+            {"key": "EmbedThumbnail"},
+        ],
+        "quiet": True,
+        "no_warnings": True,
+    },
+    "audio_mp3": {
+        "format": "bestaudio/best",
+        "outtmpl": "%(title)s.%(ext)s",
+        "postprocessors": [
+            {
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": "mp3",
+                "preferredquality": "192",
+            }
+        ],
+        "quiet": True,
+        "no_warnings": True,
+    },
+}
+
+# Instances per profile, also the number of concurrent jobs per profile.
+YDL_POOL_SIZE = 3
+
+_MISSING = object()
+
+
+class YoutubeDLPool:
+    """Thread-safe pool of YoutubeDL objects, one free list per profile."""
+
+    def __init__(self, profiles: dict[str, dict], size: int):
+        self.profiles = profiles
+        self.size = size
+        self._idle = {name: queue.LifoQueue() for name in profiles}
+        self._slots = {name: threading.BoundedSemaphore(size) for name in profiles}
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"checkouts": 0, "created": 0, "dropped": 0})
+
+    def _count(self, profile: str, field: str):
+        with self._lock:
+            self._stats[profile][field] += 1
+
+    def _take(self, profile: str) -> yt_dlp.YoutubeDL:
+        try:
+            return self._idle[profile].get_nowait()
+        except queue.Empty:
+            self._count(profile, "created")
+            return yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+
+    @contextmanager
+    def checkout(self, profile: str, progress_hooks: list | None = None, **params):
+        """
+        Borrow an instance of ``profile`` for the current thread.
+
+        ``params`` override options for this checkout only, e.g.
+        ``paths={"home": staging_dir}``, and ``progress_hooks`` are attached
+        for its duration. An instance whose job raised is closed instead
+        of being returned to the pool. Callers may swap ``format_selector``
+        for one job, it is reset on return.
+        """
+        progress_hooks = progress_hooks or []
+        self._slots[profile].acquire()
+        ydl = None
+        try:
+            ydl = self._take(profile)
+            self._count(profile, "checkouts")
+            saved = {key: ydl.params.get(key, _MISSING) for key in params}
+            format_selector = ydl.format_selector
+            ydl.params.update(params)
+            for hook in progress_hooks:
+                ydl.add_progress_hook(hook)
+            try:
+                yield ydl
+            except BaseException:
+                self._count(profile, "dropped")
+                ydl.close()
+                ydl = None
+                raise
+            finally:
+                if ydl is not None:
+                    for hook in progress_hooks:
+                        ydl._progress_hooks.remove(hook)
+                    ydl.format_selector = format_selector
+                    for key, value in saved.items():
+                        if value is _MISSING:
+                            ydl.params.pop(key, None)
+                        else:
+                            ydl.params[key] = value
+            self._idle[profile].put(ydl)
+        finally:
+            self._slots[profile].release()
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+        for name in stats:
+            stats[name]["idle"] = self._idle[name].qsize()
+        return stats
+
+
+YDL_POOL = YoutubeDLPool(YDL_PROFILES, YDL_POOL_SIZE)
@@ -0,0 +1,221 @@
+import asyncio
+import io
+import threading
+import urllib.request
+
+from app import LOGGER, bot
+
+from .ytformat import FALLBACK_FORMAT, select_video_format
+from .ytpool import YDL_POOL
+
+# ---------------------------------------------------------------------------
+# Direct URL passthrough: small progressive video formats are piped from
+# YouTube into Telegram's upload without touching the disk. Audio always
+# takes the download path, which tags it and embeds the cover.
+# ---------------------------------------------------------------------------
+
+YTDL_PASSTHROUGH = True
+PASSTHROUGH_MAX_BYTES = 100 * 1024 * 1024
+
+# googlevideo throttles long unranged reads, yt-dlp uses the same size.
+STREAM_RANGE_SIZE = 10 * 1024 * 1024
+STREAM_READ_SIZE = 64 * 1024
+# Read-ahead limit, also the most memory one stream holds.
+STREAM_BUFFER_BYTES = 8 * 1024 * 1024
+# Part size pyrogram reads per upload request.
+UPLOAD_PART_SIZE = 512 * 1024
+
+
+class StreamingUpload(io.BytesIO):
+    """
+    Forward-only file object over an HTTP media URL.
+
+    A worker thread fetches the URL in ranges into a bounded buffer and
+    pyrogram's ``save_file`` reads parts from it. It subclasses BytesIO
+    only so pyrogram accepts it as an in-memory upload; the BytesIO
+    storage itself stays empty. ``read`` blocks while the buffer is behind;
+    passing ``gate(progress)`` as the upload progress callback waits for
+    the next part off the event loop instead.
+    """
+
+    def __init__(self, url: str, size: int, headers: dict, name: str):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.headers = headers
+        self.name = name
+        self._buffer = bytearray()
+        self._pos = 0
+        self._reported: int | None = None
+        self._done = False
+        self._error: Exception | None = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _produce(self):
+        offset = 0
+        try:
+            while offset < self.size:
+                end = min(offset + STREAM_RANGE_SIZE, self.size) - 1
+                request = urllib.request.Request(
+                    self.url, headers={**self.headers, "Range": f"bytes={offset}-{end}"}
+                )
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    if response.status != 206:
+                        if offset:
+                            raise IOError("server ignored the range request")
+                        # The whole body came back, read it in one go.
+                        end = self.size - 1
+                    while offset <= end:
+                        chunk = response.read(min(STREAM_READ_SIZE, end + 1 - offset))
+                        if not chunk:
+                            raise IOError(
+                                f"stream ended at {offset} of {self.size} bytes"
+                            )
+                        with self._cond:
+                            while (
+                                len(self._buffer) >= STREAM_BUFFER_BYTES
+                                and not self.closed
+                            ):
+                                self._cond.wait()
+                            if self.closed:
+                                return
+                            self._buffer += chunk
+                            self._cond.notify_all()
+                        offset += len(chunk)
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def _wait_buffered(self, amount: int):
+        amount = min(amount, self.size - self._pos, STREAM_BUFFER_BYTES)
+        with self._cond:
+            while len(self._buffer) < amount and not self._done:
+                self._cond.wait()
+        if self._error:
+            raise self._error
+
+    async def wait_ready(self, amount: int = UPLOAD_PART_SIZE):
+        await asyncio.to_thread(self._wait_buffered, amount)
+
+    def gate(self, progress=None):
+        """Progress callback that also waits for the next part to arrive."""
+
+        async def gated(current: int, total: int, *args):
+            if progress:
+                await progress(current, total, *args)
+            await self.wait_ready()
+
+        return gated
+
+    def read(self, size: int | None = -1) -> bytes:
+        remaining = self.size - self._pos
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        self._wait_buffered(size)
+        if len(self._buffer) < size:
+            raise IOError(f"stream ended at {self._pos} of {self.size} bytes")
+        with self._cond:
+            chunk = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            self._cond.notify_all()
+        self._pos += size
+        return chunk
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # pyrogram probes the size with seek(0, SEEK_END) + tell(), then
+        # rewinds; anything else would need the stream to go backwards.
+        if whence == io.SEEK_END and offset == 0:
+            self._reported = self.size
+            return self.size
+        target = offset if whence == io.SEEK_SET else self._pos + offset
+        if target != self._pos:
+            raise io.UnsupportedOperation("streaming upload can't seek")
+        self._reported = None
+        return target
+
+    def tell(self) -> int:
+        return self._pos if self._reported is None else self._reported
+
+    def close(self):
+        with self._cond:
+            super().close()
+            self._buffer.clear()
+            self._cond.notify_all()
+
+
+def _direct_format(info: dict, max_bytes: int) -> dict | None:
+    """A single-file video format that Telegram plays as is, or None."""
+    spec, _ = select_video_format(info)
+    if spec == FALLBACK_FORMAT or "+" in spec:
+        return None
+    formats = {fmt["format_id"]: fmt for fmt in info.get("formats") or []}
+    fmt = formats.get(spec)
+
+    if (
+        not fmt
+        or fmt.get("protocol") not in ("http", "https")
+        or not fmt.get("filesize")
+        or fmt["filesize"] > max_bytes
+    ):
+        return None
+    return fmt
+
+
+@bot.make_async
+def resolve_stream(url: str, max_bytes: int) -> tuple[StreamingUpload | None, dict]:
+    """
+    Unstarted StreamingUpload for the video at ``url`` and its info. The
+    stream is None when the video needs a merge or is larger than
+    ``max_bytes``.
+    """
+    with YDL_POOL.checkout("video") as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    fmt = _direct_format(info, max_bytes)
+    if not fmt:
+        return None, info
+
+    LOGGER.info(f"ytdl {info['id']}: streaming format {fmt['format_id']}")
+    stream = StreamingUpload(
+        url=fmt["url"],
+        size=fmt["filesize"],
+        headers=fmt.get("http_headers") or {},
+        name=f"{info.get('title') or info['id']}.{fmt['ext']}",
+    )
+    return stream, info
+
+
+async def open_stream(url: str) -> tuple[StreamingUpload | None, dict | None]:
+    """
+    Started stream for the video at ``url`` with its first part buffered,
+    and the extracted info. The stream is None when the caller should take the
+    download path, which can reuse the info if there is one. Close the
+    stream after use.
+    """
+    if not YTDL_PASSTHROUGH:
+        return None, None
+    try:
+        stream, info = await resolve_stream(url, PASSTHROUGH_MAX_BYTES)
+    except Exception as e:
+        LOGGER.warning(f"ytdl passthrough: resolving {url} failed: {e}")
+        return None, None
+    if not stream:
+        return None, info
+
+    stream.start()
+    try:
+        await stream.wait_ready()
+    except Exception as e:
+        stream.close()
+        LOGGER.warning(f"ytdl passthrough: fetching {url} failed: {e}")
+        return None, info
+    except BaseException:
+        stream.close()
+        raise
+    return stream, info